@@ -275,15 +275,18 @@ def afstool_pack(folder_path:Path, afs_path:Path):
 def afstool_unpack(afs_path:Path, folder_path:Path):
     if os.system(f"python afstool.py -u \"{afs_path}\" \"{folder_path}\"") != 0:
         raise Exception("Error while unpacking.")
-def afstool_stats(path:Path):
-    if os.system(f"python afstool.py -s \"{path}\" > NUL") != 0:
+def afstool_stats(path:Path, stats_format:str = "txt"):
+    if os.system(f"python afstool.py -s -f {stats_format} \"{path}\" > NUL") != 0:
         raise Exception("Error while getting stats.")
 def afstool_rebuild(folder_path:Path):
     if os.system(f"python afstool.py -r \"{folder_path}\"") != 0:
         raise Exception("Error while rebuilding.")
+def afstool_replace(afs_path:Path, manifest_path:Path, new_afs_path:Path):
+    if os.system(f"python afstool.py -rl \"{afs_path}\" \"{manifest_path}\" \"{new_afs_path}\"") != 0:
+        raise Exception("Error while replacing.")
 
 
-TEST_COUNT = 10
+TEST_COUNT = 11
 
 
 start = time()
@@ -317,16 +320,22 @@ for afs_path in afss_paths:
 # AFSPacker don't store the date present in the filename directory in the file metadatas and update every dates when packing
 for folder_path in unpack_path.glob("*"):
     compare_folders(folder_path / "root", afspacker_unpack_path / folder_path.stem)
+    # sys/manifest must match the freshly unpacked folder
+    manifest = afstool.Manifest(folder_path)
+    manifest.load()
+    if manifest.get_changes():
+        raise Exception(f"Error - Invalid sys/manifest in \"{folder_path}\": {manifest.get_changes()}.")
 
 print("###############################################################################")
 print(f"# TEST 2/{TEST_COUNT}")
-print("# Testing --stats command with all AFS and all unpacked AFS.")
+print("# Testing --stats command with all AFS and all unpacked AFS in all formats.")
 print("###############################################################################")
-for afs_path in afss_path.glob("*"):
-    afstool_stats(afs_path)
+for stats_format in ["txt", "json", "csv"]:
+    for afs_path in afss_path.glob("*"):
+        afstool_stats(afs_path, stats_format)
 
-for folder_path in unpack_path.glob("*"):
-    afstool_stats(folder_path)
+    for folder_path in unpack_path.glob("*"):
+        afstool_stats(folder_path, stats_format)
 
 print("###############################################################################")
 print(f"# TEST 3/{TEST_COUNT}")
@@ -474,19 +483,19 @@ for afs_rebuild_conf in [afs_rebuild_conf1, afs_rebuild_conf2]:
 
     test_except(afs_rebuild_conf, afstool.AfsInvalidFilePathError, "d.bin?0x1?0x1000?d.bin")
     test_except(afs_rebuild_conf, afstool.AfsInvalidFieldsCountError, "b.bin?0x1?0x1000?b.bin?d")
-    for tmp_conf in ["index", "mixed"]:
+    for tmp_conf in ["index", "mixed", "compact"]:
         afs_rebuild_conf["Default"]["files_rebuild_strategy"] = tmp_conf
         test_except(afs_rebuild_conf, afstool.AfsIndexValueError, "b.bin?123?0x1000?b.bin")
         test_except(afs_rebuild_conf, afstool.AfsIndexOverflowError, "b.bin?0x3?0x1000?b.bin")
         test_except(afs_rebuild_conf, afstool.AfsIndexCollisionError, "b.bin?0x1?0x1000?b.bin\nc.bin?0x1?0x2000?c.bin")
 
-    for tmp_conf in ["offset", "mixed"]:
+    for tmp_conf in ["offset", "mixed", "compact"]:
         afs_rebuild_conf["Default"]["files_rebuild_strategy"] = tmp_conf
         test_except(afs_rebuild_conf, afstool.AfsOffsetValueError, "b.bin?0x1?123?b.bin")
         test_except(afs_rebuild_conf, afstool.AfsOffsetAlignError, "b.bin?0x1?0x555?b.bin")
         test_except(afs_rebuild_conf, afstool.AfsOffsetCollisionError, "b.bin?0x1?0x8000?b.bin\nc.bin?0x2?0x8000?c.bin")
 
-    for tmp_conf in ["auto", "index", "offset", "mixed"]:
+    for tmp_conf in ["auto", "index", "offset", "mixed", "compact"]:
         afs_rebuild_conf["Default"]["files_rebuild_strategy"] = tmp_conf
         test_except(afs_rebuild_conf, afstool.AfsEmptyBlockValueError, "123?0x800")
         test_except(afs_rebuild_conf, afstool.AfsEmptyBlockValueError, "0x800?123")
@@ -517,7 +526,7 @@ print("#########################################################################
 print(f"# TEST 10/{TEST_COUNT}")
 print("# Testing rebuild - (afs_rebuild.conf & afs_rebuild.csv).")
 print("###############################################################################")
-tmp_count = 10
+tmp_count = 11
 raw_data = tmp_count * [None]
 raw_header_data = tmp_count * [None]
 raw_fd_header = tmp_count * [None]
@@ -576,6 +585,12 @@ raw_header_data[9] = b"\x41\x46\x53\x00"+list_bytes([0x3, 0x2800, 0x601, 0x6000,
 raw_fd_header[9]   = list_bytes([0x9800, 0x90])
 raw_files_data[9]  = b"\x00"*0x2000+(b"\xff"*0x601).ljust(0x800, b"\x00") + b"\x00"*0x3000 + (b"\xff"*0x702).ljust(0x800, b"\x00") + b"\x00"*0x2000 + (b"\xff"*0x803).ljust(0x1000, b"\x00")
 raw_fd_data[9]     = raw_fd_data[3]
+# compact: b pinned at 0x2800 - biggest first: d->0x800 a->0x3000 (too big for the hole) c->0x2000
+# toc: abcd content: dcba
+raw_header_data[10] = b"\x41\x46\x53\x00"+list_bytes([0x4, 0x3000, 0x900, 0x2800, 0x600, 0x2000, 0x700, 0x800, 0x1800])
+raw_fd_header[10]   = list_bytes([0x4000, 0xc0])
+raw_files_data[10]  = b"\xff"*0x1800 + (b"\xff"*0x700).ljust(0x800, b"\x00") + (b"\xff"*0x600).ljust(0x800, b"\x00") + (b"\xff"*0x900).ljust(0x1000, b"\x00")
+raw_fd_data[10]     = raw_fd_data[5]
 
 afs_rebuild_conf3 = copy.deepcopy(afs_rebuild_conf2)
 afs_rebuild_conf3["FilenameDirectory"]["toc_offset_of_fd_offset"] = "0x500"
@@ -613,6 +628,27 @@ for afs_rebuild_conf in [afs_rebuild_conf1, afs_rebuild_conf2, afs_rebuild_conf3
         afs_rebuild_conf["Default"]["files_rebuild_strategy"] = tmp_conf
         test_rebuild_repack(afs_rebuild_conf, [("a.bin", 0x601),("b.bin",  0x702),("c.bin", 0x803)], raw_data[9], "0x800?0x2000\n0x3000?0x3000\n0x7000?0x1800", raw_fd_data=raw_fd_data[9])
 
+    afs_rebuild_conf["Default"]["files_rebuild_strategy"] = "compact"
+    test_rebuild_repack(afs_rebuild_conf, [("a.bin", 0x900),("b.bin", 0x600),("c.bin", 0x700),("d.bin", 0x1800)], raw_data[10], "b.bin?auto?0x2800?b.bin", raw_fd_data=raw_fd_data[10])
+    afs_rebuild_conf["Default"]["files_rebuild_strategy"] = "auto"
+
+print("###############################################################################")
+print(f"# TEST 11/{TEST_COUNT}")
+print("# Comparing [afss_path]->replace(all unpacked files)->[repack_path].")
+print("###############################################################################")
+for afs_path in afss_path.glob("*"):
+    folder_path = unpack_path / f"replace_{afs_path.stem}"
+    afstool_unpack(afs_path, folder_path)
+    # afs_rebuild.csv lines: unpacked_filename?index?offset?filename
+    manifest_data = ""
+    for line in (folder_path / "sys/afs_rebuild.csv").read_text().split('\n'):
+        line_splited = line.split('?')
+        manifest_data += f"{line_splited[1]}?root/{line_splited[0]}\n"
+    (folder_path / "replace_manifest.csv").write_text(manifest_data)
+    afstool_replace(afs_path, folder_path / "replace_manifest.csv", repack_path / afs_path.name)
+    if not compare_files(afs_path, repack_path / afs_path.name):
+        raise Exception(f"Error - \"{afs_path}\" and \"{repack_path / afs_path.name}\" are different.")
+
 print("###############################################################################")
 print("# Cleaning test folders.")
 print("###############################################################################")
@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
 from configparser import ConfigParser
+import csv
 from datetime import datetime
+import json
 import logging
 from math import ceil
 import os
 from pathlib import Path
 import re
+import sys
 import time
+import zlib
 
 
 __version__ = "0.2.0"
@@ -43,6 +47,7 @@ class AfsFdLastAttributeTypeValueError(Exception): pass
 class AfsFdOffsetCollisionError(Exception): pass
 class AfsEmptyBlockValueError(Exception): pass
 class AfsEmptyBlockAlignError(Exception): pass
+class AfsManifestEntryError(Exception): pass
 
 
 def normalize_parent(path_str:str):
@@ -131,6 +136,121 @@ class FilenameResolver:
         return filename
 
 
+class FolderSnapshot:
+    """
+    Constructor: path of the folder to scan
+    DESCRIPTION
+        Walk the folder once using os.scandir and keep the stat of each file:
+        {relative_path: os.stat_result, ... } with posix relative paths.
+        Sizes, mtimes and inodes are then read from the snapshot instead of
+        calling stat() multiple times per file. On Windows the stat comes
+        with the directory listing so there is no extra syscall at all.
+    """
+    __folder_path = None
+    # stats_dict: {relative_path: os.stat_result, ... }
+    __stats_dict = None
+    def __init__(self, folder_path:Path):
+        self.__folder_path = folder_path
+        self.__stats_dict = {}
+        self.__scan(folder_path, "")
+    def __scan(self, path:Path, prefix:str):
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    self.__scan(entry.path, f"{prefix}{entry.name}/")
+                elif entry.is_file():
+                    self.__stats_dict[prefix + entry.name] = entry.stat()
+    def is_file(self, relative_path:str):
+        return relative_path in self.__stats_dict
+    def stat(self, relative_path:str):
+        "return the os.stat_result of the file: st_size, st_mtime, st_ino, ..."
+        return self.__stats_dict[relative_path]
+    def paths(self):
+        return list(self.__stats_dict)
+
+
+def get_file_crc32(file_path:Path):
+    "Compute the crc32 of a file by blocks."
+    crc32 = 0
+    with file_path.open("rb") as file:
+        data = file.read(Afs.COPY_BLOCK_LEN)
+        while data:
+            crc32 = zlib.crc32(data, crc32)
+            data = file.read(Afs.COPY_BLOCK_LEN)
+    return crc32
+
+
+class Manifest:
+    """
+    Constructor: path of the unpacked AFS folder
+    DESCRIPTION
+        Use sys/manifest to store informations about each extracted file.
+        Each line contains "relative_path?offset?length?mtime?crc32" with
+        relative_path from the unpacked AFS folder. The crc32 is computed
+        during unpack while the data is in memory so finding modified files
+        doesn't need to read the original AFS again. Files with the same
+        length and mtime are considered unchanged without reading them.
+    """
+    __folder_path = None
+    # entries_dict: {relative_path: (offset, length, mtime, crc32), ... }
+    __entries_dict = None
+    __separator = '?'
+    def __init__(self, folder_path:Path):
+        self.__folder_path = folder_path
+        self.__entries_dict = {}
+    def add(self, relative_path:str, offset:int, data:bytes, mtime:int):
+        "Add an extracted file using data to compute the crc32"
+        self.__entries_dict[relative_path] = (offset, len(data), round(mtime), zlib.crc32(data))
+    def save(self):
+        logging.info(f"Writting {Path('sys/manifest')}")
+        (self.__folder_path / "sys" / "manifest").write_text("\n".join(
+            f"{path}{self.__separator}0x{offset:x}{self.__separator}0x{length:x}{self.__separator}{mtime}{self.__separator}{crc32:08x}" \
+            for path, (offset, length, mtime, crc32) in self.__entries_dict.items()))
+    def load(self):
+        if not (self.__folder_path / "sys" / "manifest").is_file():
+            raise AfsInvalidAfsFolderError(f"Error - {self.__folder_path / 'sys' / 'manifest'} not found. Unpack the AFS again to generate it.")
+        for line in (self.__folder_path / "sys" / "manifest").read_text().split('\n'):
+            if line == "":
+                continue
+            (path, offset, length, mtime, crc32) = line.rsplit(self.__separator, 4)
+            self.__entries_dict[path] = (int(offset, 16), int(length, 16), int(mtime), int(crc32, 16))
+    def is_unchanged(self, relative_path:str, file_stat:os.stat_result = None):
+        """
+        input: relative_path = str
+        input: file_stat = os.stat_result if already known
+        return True if the file has the same length and (mtime or crc32) than when unpacked
+        """
+        if relative_path not in self.__entries_dict:
+            return False
+        (offset, length, mtime, crc32) = self.__entries_dict[relative_path]
+        if file_stat is None:
+            file_stat = (self.__folder_path / relative_path).stat()
+        if file_stat.st_size != length:
+            return False
+        return round(file_stat.st_mtime) == mtime or get_file_crc32(self.__folder_path / relative_path) == crc32
+    def get_changes(self):
+        """
+        Compare the unpacked folder with the manifest.
+        return [(status, relative_path), ...] with status = "modified", "removed" or "added"
+        """
+        changes = []
+        root_snapshot = FolderSnapshot(self.__folder_path / "root")
+        for relative_path in self.__entries_dict:
+            if relative_path[:5] == "root/":
+                if not root_snapshot.is_file(relative_path[5:]):
+                    changes.append( ("removed", relative_path) )
+                elif not self.is_unchanged(relative_path, root_snapshot.stat(relative_path[5:])):
+                    changes.append( ("modified", relative_path) )
+            elif not (self.__folder_path / relative_path).is_file():
+                changes.append( ("removed", relative_path) )
+            elif not self.is_unchanged(relative_path):
+                changes.append( ("modified", relative_path) )
+        for relative_path in root_snapshot.paths():
+            if "root/" + relative_path not in self.__entries_dict:
+                changes.append( ("added", "root/" + relative_path) )
+        return changes
+
+
 class Afs:
     """
     DESCRIPTION  Afs handle all operations needed by the command parser
@@ -144,6 +264,9 @@ class Afs:
     HEADER_LEN = 8
     # Each entry in the FD have 32 chars for filename and the rest for date and last_fd_attribute
     FILENAMEDIRECTORY_ENTRY_LEN = 0x30
+    # Length of blocks used when copying ranges between files
+    COPY_BLOCK_LEN = 0x100000
+    PAD = bytes(ALIGN)
     __file_count = None
     # this offset is at the end of the TOC and sometimes there is pad
     __filenamedirectory_offset_offset = None
@@ -179,6 +302,8 @@ class Afs:
         return time.mktime(datetime(year=year, month=month, day=day, hour=hour, minute=minute, second=second).timetuple())
     def __patch_file_len(self, fileindex:int, file_len:int): # Patch file_len in the TOC
         self.__tableofcontent[Afs.HEADER_LEN+fileindex*8+4:Afs.HEADER_LEN+fileindex*8+8] = file_len.to_bytes(4, "little")
+    def __patch_file_offset(self, fileindex:int, file_offset:int): # Patch file_offset in the TOC
+        self.__tableofcontent[Afs.HEADER_LEN+fileindex*8:Afs.HEADER_LEN+fileindex*8+4] = file_offset.to_bytes(4, "little")
     def __patch_file_mtime(self, fileindex:int, mtime):
         mtime = datetime.fromtimestamp(mtime)
         self.__filenamedirectory[Afs.FILENAMEDIRECTORY_ENTRY_LEN*fileindex+32:Afs.FILENAMEDIRECTORY_ENTRY_LEN*fileindex+44] = \
@@ -201,11 +326,42 @@ class Afs:
             if updated_fdlast_index < self.__file_count:
                 self.__filenamedirectory[updated_fdlast_index*Afs.FILENAMEDIRECTORY_ENTRY_LEN+44:updated_fdlast_index*Afs.FILENAMEDIRECTORY_ENTRY_LEN+48] = self.__get_file_len(fileindex).to_bytes(4, "little")
         # fd_last_attribute_type == unknown
-    def __pad(self, data:bytes):
-        "Add padding to align datas to next block"
-        if len(data) % Afs.ALIGN != 0:
-            data += b"\x00" * (Afs.ALIGN - (len(data) % Afs.ALIGN))
-        return data
+    def __write_pad(self, afs_file, end_offset:int):
+        """
+        Align the AFS after data ending at end_offset without building padded copies of the data.
+        Seeking after the end of the AFS and the final truncate create zeros so pad is written
+        only when it overwrite already written datas.
+        input: afs_file = file opened in wb mode positioned at end_offset
+        input: end_offset = int
+        return the aligned end offset
+        """
+        aligned_end_offset = int(ceil(end_offset / Afs.ALIGN)) * Afs.ALIGN
+        if aligned_end_offset > end_offset and afs_file.seek(0, os.SEEK_END) > end_offset:
+            afs_file.seek(end_offset)
+            afs_file.write(Afs.PAD[:aligned_end_offset - end_offset])
+        return aligned_end_offset
+    def __copy_file(self, file_path:Path, afs_file, buffer:memoryview):
+        """
+        Copy file_path at the current position of afs_file using the reusable buffer.
+        return the number of bytes copied
+        """
+        copied_len = 0
+        with file_path.open("rb") as file:
+            read_len = file.readinto(buffer)
+            while read_len:
+                afs_file.write(buffer[:read_len])
+                copied_len += read_len
+                read_len = file.readinto(buffer)
+        return copied_len
+    def __copy_range(self, src_file, dst_file, offset:int, length:int):
+        "Copy length bytes of src_file from offset at the current position of dst_file by blocks."
+        src_file.seek(offset)
+        while length > 0:
+            data = src_file.read(min(length, Afs.COPY_BLOCK_LEN))
+            if not data: # src_file is shorter than expected
+                break
+            dst_file.write(data)
+            length -= len(data)
     def __clean_filenamedirectory(self):
         """
         We can't know if there is a FD without searching and loading data for it
@@ -308,10 +464,9 @@ class Afs:
         if 4 in columns: stats_buffer += "| YYYY-mm-dd HH:MM:SS ";
         if 5 in columns: stats_buffer += "| FD last  ";
         if 6 in columns: stats_buffer += "| Filename";
-        stats_buffer += "\n|"+"-"*99+"\n"
+        print(stats_buffer + "\n|"+"-"*99)
         for line in lines_tuples:
-            stats_buffer += line if type(line) == str else "| "+" | ".join(line)+"\n"
-        print(stats_buffer, end='')
+            print(line if type(line) == str else "| "+" | ".join(line), end='' if type(line) == str else '\n')
     def __get_offsets_map(self):
         """
         This method is used to check the next file offset and control if there is overlapping during pack
@@ -337,26 +492,51 @@ class Afs:
             last_tuple = offsets_tuple
             offsets_map[i] = offsets_tuple[0]
         return offsets_map
-    def __get_formated_map(self):
+    def __get_files_map(self):
         """
         This method is used for stats command
         end offset not included (0,1) -> len=1
+        return a list of tuples (index, offset, length, mtime, fd_last, filename)
+        index is "SYS TOC" or "SYS FD" for sys files, mtime and fd_last are None without FD
         """
-        files_map = [("SYS TOC ", "00000000", f"{len(self.__tableofcontent):08x}", f"{len(self.__tableofcontent):08x}", "SYS TOC"+' '*12, "SYS TOC ", "SYS TOC")]
+        files_map = [("SYS TOC", 0, len(self.__tableofcontent), None, None, "SYS TOC")]
 
         for i in range(self.__file_count):
-            file_offset = self.__get_file_offset(i)
-            file_len    = self.__get_file_len(i)
-            file_date   = datetime.fromtimestamp(self.__get_file_mtime(i)).strftime("%Y-%m-%d %H:%M:%S") if self.__filenamedirectory else " "*19
-            filename    = self.__get_file_name(i) if self.__filenamedirectory else f"{i:08}"
-            fdlast      = f"{self.__get_file_fdlast(i):08x}" if self.__filenamedirectory else " "*8
-            files_map.append((f"{i:08x}", f"{file_offset:08x}", f"{file_offset + file_len:08x}", f"{file_len:08x}", file_date, fdlast, filename))
+            file_mtime = self.__get_file_mtime(i) if self.__filenamedirectory else None
+            fdlast     = self.__get_file_fdlast(i) if self.__filenamedirectory else None
+            filename   = self.__get_file_name(i) if self.__filenamedirectory else f"{i:08}"
+            files_map.append((i, self.__get_file_offset(i), self.__get_file_len(i), file_mtime, fdlast, filename))
 
         if self.__filenamedirectory:
-            files_map.append(("SYS FD  ", f"{self.__filenamedirectory_offset:08x}", \
-                f"{self.__filenamedirectory_offset + len(self.__filenamedirectory):08x}", \
-                f"{len(self.__filenamedirectory):08x}", "SYS FD"+' '*13, "SYS FD  ", "SYS FD"))
+            files_map.append(("SYS FD", self.__filenamedirectory_offset, len(self.__filenamedirectory), None, None, "SYS FD"))
         return files_map
+    def __format_file_tuple(self, file_tuple:tuple):
+        "Format a __get_files_map tuple for the stats tables."
+        (index, offset, length, mtime, fdlast, filename) = file_tuple
+        if type(index) == str:
+            return (index.ljust(8), f"{offset:08x}", f"{offset + length:08x}", f"{length:08x}", index.ljust(19), index.ljust(8), index)
+        file_date = datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M:%S") if mtime is not None else " "*19
+        fdlast    = f"{fdlast:08x}" if fdlast is not None else " "*8
+        return (f"{index:08x}", f"{offset:08x}", f"{offset + length:08x}", f"{length:08x}", file_date, fdlast, filename)
+    def __print_records(self, path:Path, stats_format:str, files_map:list, overlap_flags:list, dup_name_flags:list, empty_blocks:dict):
+        """
+        Stream stats records one by one in json lines or csv format.
+        Each entry record is followed by the empty block following it if there is one.
+        """
+        fields = ["afs", "type", "index", "offset", "end_offset", "length", "mtime", "fd_last", "filename", "overlap", "duplicate_name"]
+        if stats_format == "csv":
+            writer = csv.writer(sys.stdout, lineterminator="\n")
+            writer.writerow(fields)
+            write_record = lambda record: writer.writerow(["" if value is None else value for value in record])
+        else:
+            write_record = lambda record: print(json.dumps(dict(zip(fields, record))))
+
+        for pos, (index, offset, length, mtime, fdlast, filename) in enumerate(files_map):
+            file_date = datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M:%S") if mtime is not None else None
+            write_record((str(path), "entry", index, offset, offset + length, length, file_date, fdlast, filename, overlap_flags[pos], dup_name_flags[pos]))
+            if pos in empty_blocks:
+                (empty_offset, empty_end_offset) = empty_blocks[pos]
+                write_record((str(path), "empty_block", None, empty_offset, empty_end_offset, empty_end_offset - empty_offset, None, None, filename, False, False))
     def __get_fdlast_type(self):
         """
         At the end of the FD there is 4 bytes used for different purposes
@@ -423,6 +603,7 @@ class Afs:
         root_path.mkdir()
 
         resolver = None
+        manifest = Manifest(folder_path)
         with afs_path.open("rb") as afs_file:
             if not self.__loadsys_from_afs(afs_file, afs_path.stat().st_size):
                 logging.info("There is no filename directory. Creating new names and dates for files.")
@@ -430,10 +611,12 @@ class Afs:
                 logging.debug(f"filenamedirectory_offset:0x{self.__filenamedirectory_offset:x}, filenamedirectory_len:0x{self.__filenamedirectory_len:x}.")
                 logging.info("Writting sys/filenamedirectory.bin")
                 (sys_path / "filenamedirectory.bin").write_bytes(self.__filenamedirectory)
+                manifest.add("sys/filenamedirectory.bin", self.__filenamedirectory_offset, self.__filenamedirectory, (sys_path / "filenamedirectory.bin").stat().st_mtime)
                 resolver = FilenameResolver(sys_path)
 
             logging.info("Writting sys/tableofcontent.bin")
             (sys_path / "tableofcontent.bin").write_bytes(self.__tableofcontent)
+            manifest.add("sys/tableofcontent.bin", 0, self.__tableofcontent, (sys_path / "tableofcontent.bin").stat().st_mtime)
 
             logging.info(f"Extracting {self.__file_count} files.")
             for i in range(self.__file_count):
@@ -446,15 +629,20 @@ class Afs:
                 
                 logging.debug(f"Writting {root_path / filename} 0x{file_offset:x}:0x{file_offset + file_len:x}")
                 afs_file.seek(file_offset)
-                (root_path / filename).write_bytes(afs_file.read(file_len))
+                file_data = afs_file.read(file_len)
+                (root_path / filename).write_bytes(file_data)
 
                 if self.__filenamedirectory:
                     mtime = self.__get_file_mtime(i)
                     os.utime(root_path / filename, (mtime, mtime))
+                else:
+                    mtime = (root_path / filename).stat().st_mtime
+                manifest.add(f"root/{Path(filename).as_posix()}", file_offset, file_data, mtime)
 
             if self.__filenamedirectory:
                 resolver.save()
         self.__write_rebuild_config(sys_path, resolver)
+        manifest.save()
     def pack(self, folder_path:Path, afs_path:Path = None):
         """
         Methood used to pack un unpacked folder inside a new AFS file
@@ -471,6 +659,7 @@ class Afs:
 
         self.__loadsys_from_folder(sys_path)
         resolver = FilenameResolver(sys_path)
+        root_snapshot = FolderSnapshot(root_path)
         offsets_map = self.__get_offsets_map()
 
         if self.__filenamedirectory:
@@ -478,6 +667,8 @@ class Afs:
             if fd_last_attribute_type[:2] == "0x":
                 fd_last_attribute_type = int(fd_last_attribute_type, 16)
 
+        buffer = memoryview(bytearray(Afs.COPY_BLOCK_LEN))
+        afs_len = 0
         try:
             with afs_path.open("wb") as afs_file:
                 # We update files
@@ -487,7 +678,11 @@ class Afs:
                     filename    = resolver.resolve_from_index(i, self.__get_file_name(i) if self.__filenamedirectory else f"{i:08}")
 
                     file_path = root_path / filename
-                    new_file_len = file_path.stat().st_size
+                    # snapshot paths use "/" separators
+                    if not root_snapshot.is_file(Path(filename).as_posix()):
+                        raise AfsInvalidFilePathError(f"Error - File {file_path} doesn't exist. Use sys/filename_resolver.csv for renamed files.")
+                    file_stat = root_snapshot.stat(Path(filename).as_posix())
+                    new_file_len = file_stat.st_size
                     
                     if new_file_len != file_len:
                         # If no FD, we can raise AFS length without constraint
@@ -501,19 +696,177 @@ class Afs:
                             self.__patch_fdlasts(i, fd_last_attribute_type)
                     # If there is a filenamedirectory we update mtime:
                     if self.__filenamedirectory:
-                        self.__patch_file_mtime(i, round(file_path.stat().st_mtime))
+                        self.__patch_file_mtime(i, round(file_stat.st_mtime))
                     logging.debug(f"Packing {file_path} 0x{file_offset:x}:0x{file_offset+new_file_len:x} in AFS.")
                     afs_file.seek(file_offset)
-                    afs_file.write(self.__pad(file_path.read_bytes()))
+                    copied_len = self.__copy_file(file_path, afs_file, buffer)
+                    afs_len = max(afs_len, self.__write_pad(afs_file, file_offset + copied_len))
                 if self.__filenamedirectory:
                     afs_file.seek(self.__filenamedirectory_offset)
-                    afs_file.write(self.__pad(self.__filenamedirectory))
+                    afs_file.write(self.__filenamedirectory)
+                    afs_len = max(afs_len, self.__write_pad(afs_file, self.__filenamedirectory_offset + len(self.__filenamedirectory)))
                 logging.debug(f"Packing {sys_path / 'tableofcontent.bin'} at the beginning of the AFS.")
                 afs_file.seek(0)
                 afs_file.write(self.__tableofcontent)
-        except AfsInvalidFileLenError:
+                afs_file.truncate(max(afs_len, len(self.__tableofcontent)))
+        except (AfsInvalidFileLenError, AfsInvalidFilePathError):
             afs_path.unlink()
             raise
+    def __load_replace_manifest(self, manifest_path:Path):
+        """
+        Parse the replace manifest: one "index_or_filename?replacement_path" entry per line.
+        index use hex format 0xabcdef, filename is the FD filename (or 00000000 style names without FD).
+        Relative replacement paths are relative to the manifest folder.
+        return {file_index: replacement_path, ...}
+        """
+        names_dict = {}
+        for i in range(self.__file_count):
+            filename = self.__get_file_name(i) if self.__filenamedirectory else f"{i:08}"
+            names_dict[filename] = None if filename in names_dict else i # None when duplicated
+
+        replacements = {}
+        for line in manifest_path.read_text().split('\n'):
+            if line == "":
+                continue
+            line_splited = line.split('?')
+            if len(line_splited) != 2:
+                raise AfsManifestEntryError(f"Error - Invalid entry fields count in {manifest_path}: \"{line}\"")
+            if line_splited[0][:2] == "0x":
+                if len(line_splited[0]) < 3:
+                    raise AfsManifestEntryError(f"Error - Invalid entry index in {manifest_path}: \"{line}\"")
+                index = int(line_splited[0][2:], 16)
+                if index >= self.__file_count:
+                    raise AfsManifestEntryError(f"Error - Invalid entry index in {manifest_path}: \"{line}\" - index must be < files_count.")
+            else:
+                if line_splited[0] not in names_dict:
+                    raise AfsManifestEntryError(f"Error - Filename not found in the AFS: \"{line}\"")
+                index = names_dict[line_splited[0]]
+                if index is None:
+                    raise AfsManifestEntryError(f"Error - Multiple files use the filename: \"{line}\" - use the index instead.")
+            if index in replacements:
+                raise AfsManifestEntryError(f"Error - Multiple replacements for the index 0x{index:x}.")
+            file_path = manifest_path.parent / line_splited[1]
+            if not file_path.is_file():
+                raise AfsInvalidFilePathError(f"Error - File {file_path} doesn't exist.")
+            replacements[index] = file_path
+        return replacements
+    def replace(self, afs_path:Path, manifest_path:Path, new_afs_path:Path):
+        """
+        Replace files listed in the manifest and write the new AFS without unpacking.
+        Unchanged ranges are copied from the source AFS, when a replacement doesn't fit
+        before the next file offset all following offsets are shifted by aligned blocks.
+        TOC and FD are patched with new offsets, lengths, dates and fd_last_attributes.
+        """
+        if new_afs_path.resolve() == afs_path.resolve():
+            raise AfsInvalidFilePathError("Error - The new AFS must be different from the source AFS.")
+        afs_len = afs_path.stat().st_size
+
+        with afs_path.open("rb") as afs_file:
+            self.__loadsys_from_afs(afs_file, afs_len)
+            self.__tableofcontent = bytearray(self.__tableofcontent)
+            if self.__filenamedirectory:
+                self.__filenamedirectory = bytearray(self.__filenamedirectory)
+                fd_last_attribute_type = self.__get_fdlast_type()
+                if fd_last_attribute_type[:2] == "0x":
+                    fd_last_attribute_type = int(fd_last_attribute_type, 16)
+            replacements = self.__load_replace_manifest(manifest_path)
+
+            # slots: [old_offset, index or "TOC" or "FD"] sorted by offset - the slot end is the next slot offset
+            slots = [[0, "TOC"]] + [[self.__get_file_offset(i), i] for i in range(self.__file_count)]
+            if self.__filenamedirectory:
+                slots.append([self.__filenamedirectory_offset, "FD"])
+            self.__get_offsets_map() # raise an exception if there is files collisions
+            slots.sort(key=lambda x: x[0])
+
+            # Compute the new layout: [new_offset, old_offset, old_slot_len, new_slot_len, index]
+            layout = []
+            shift = 0
+            for i, (old_offset, index) in enumerate(slots):
+                old_slot_len = (slots[i+1][0] if i+1 < len(slots) else afs_len) - old_offset
+                new_slot_len = old_slot_len
+                if index in replacements:
+                    new_file_len = replacements[index].stat().st_size
+                    if new_file_len > old_slot_len:
+                        new_slot_len = int(ceil(new_file_len / Afs.ALIGN)) * Afs.ALIGN
+                    if new_file_len != self.__get_file_len(index):
+                        self.__patch_file_len(index, new_file_len)
+                        if self.__filenamedirectory:
+                            self.__patch_fdlasts(index, fd_last_attribute_type)
+                    if self.__filenamedirectory:
+                        self.__patch_file_mtime(index, round(replacements[index].stat().st_mtime))
+                new_offset = old_offset + shift
+                if shift > 0:
+                    if index == "FD":
+                        self.__tableofcontent[self.__filenamedirectory_offset_offset:self.__filenamedirectory_offset_offset+4] = new_offset.to_bytes(4, "little")
+                    elif index != "TOC":
+                        self.__patch_file_offset(index, new_offset)
+                layout.append( (new_offset, old_offset, old_slot_len, new_slot_len, index) )
+                shift += new_slot_len - old_slot_len
+            if shift > 0:
+                logging.info(f"Following files have been shifted by 0x{shift:x} bytes.")
+
+            try:
+                with new_afs_path.open("wb") as new_afs_file:
+                    for new_offset, old_offset, old_slot_len, new_slot_len, index in layout:
+                        if index in replacements:
+                            logging.debug(f"Replacing index 0x{index:x} with {replacements[index]} 0x{new_offset:x}:0x{new_offset + new_slot_len:x} in AFS.")
+                            with replacements[index].open("rb") as replacement_file:
+                                self.__copy_range(replacement_file, new_afs_file, 0, self.__get_file_len(index))
+                            new_afs_file.write(b"\x00" * (new_slot_len - self.__get_file_len(index)))
+                            continue
+                        # Sys files are patched then the end of the slot is copied
+                        data = self.__tableofcontent if index == "TOC" else self.__filenamedirectory if index == "FD" else b""
+                        new_afs_file.write(data)
+                        self.__copy_range(afs_file, new_afs_file, old_offset + len(data), old_slot_len - len(data))
+            except OSError:
+                new_afs_path.unlink()
+                raise
+    def __get_available_space_ranges(self, ranges:list, max_offset:int):
+        """
+        Merge pinned ranges (empty blocks and files with fixed offset) to find holes between them.
+        input: ranges = [[unpacked_filename, index, offset, filename, file_length], ...]
+        input: max_offset = int (end of the TOC)
+        return (available_space_ranges = [[begin_offset, end_offset], ...], max_offset = int)
+        """
+        available_space_ranges = []
+        # We have to sort offsets before merging to avoid complex algorithm
+        # TOC is already present with max_offset
+        for file_tuple in sorted(ranges, key=lambda x: (x[2] is not None, x[2])):
+            offset = file_tuple[2]
+            if offset is None:
+                continue
+            if offset < max_offset:
+                raise AfsOffsetCollisionError(f"Error - Offsets collision with offset \"0x{offset:x}\".")
+            elif offset > max_offset:
+                available_space_ranges.append( [max_offset, offset] )
+            max_offset = int(ceil((offset + file_tuple[4]) / Afs.ALIGN)) * Afs.ALIGN
+        return (available_space_ranges, max_offset)
+    def __allocate_offsets(self, files_lengths:list, available_space_ranges:list, current_offset:int):
+        """
+        Put each file in the first available space range with an adapted length
+        or at the end of the allocated space. available_space_ranges is updated.
+        input: files_lengths = [int, ...]
+        input: available_space_ranges = [[begin_offset, end_offset], ...]
+        input: current_offset = int (end of the allocated space)
+        return (offsets = [int, ...], current_offset = int)
+        """
+        offsets = []
+        for file_length in files_lengths:
+            block_len = int(ceil(file_length / Afs.ALIGN)) * Afs.ALIGN
+            for j in range(len(available_space_ranges)):
+                available_block_len = int(ceil((available_space_ranges[j][1] - available_space_ranges[j][0]) / Afs.ALIGN)) * Afs.ALIGN
+                if block_len <= available_block_len:
+                    offsets.append(available_space_ranges[j][0])
+                    if block_len == available_block_len:
+                        del available_space_ranges[j]
+                    else:
+                        available_space_ranges[j][0] += block_len
+                    break
+            else:
+                # Here we have a bigger file than available ranges so we pick current_offset at the end of allocated space
+                offsets.append(current_offset)
+                current_offset += block_len
+        return (offsets, current_offset)
     def rebuild(self, folder_path:Path):
         """
         Rebuild will use following config files:
@@ -527,8 +880,8 @@ class Afs:
         config.read(sys_path / "afs_rebuild.conf")
         if config["Default"]["AFS_MAGIC"] not in ["0x41465300", "0x41465320"]:
             raise AfsInvalidMagicNumberError("Error - Invalid [Default] AFS_MAGIC: must be 0x41465300 or 0x41465320.")
-        if config["Default"]["files_rebuild_strategy"] not in ["index", "offset", "mixed", "auto"]:
-            raise AfsInvalidFilesRebuildStrategy("Error - Invalid [Default] files_rebuild_strategy: must be index, offset, mixed or auto.")
+        if config["Default"]["files_rebuild_strategy"] not in ["index", "offset", "mixed", "auto", "compact"]:
+            raise AfsInvalidFilesRebuildStrategy("Error - Invalid [Default] files_rebuild_strategy: must be index, offset, mixed, auto or compact.")
         if config["Default"]["filename_directory"] not in ["True", "False"]:
             raise AfsFilenameDirectoryValueError("Error - Invalid [Default] filename_directory: must be True or False.")
        
@@ -537,7 +890,8 @@ class Afs:
                 logging.info(f"Removing {path}.")
                 path.unlink()
 
-        files_paths = [path for path in root_path.glob("**/*") if path.is_file()]
+        root_snapshot = FolderSnapshot(root_path)
+        files_paths = root_snapshot.paths()
         self.__file_count = len(files_paths)
         max_offset = None
 
@@ -574,9 +928,9 @@ class Afs:
             for line in (sys_path / "afs_rebuild.csv").read_text().split('\n'):
                 line_splited = line.split('?')
                 if len(line_splited) == 4:
-                    unpacked_filename = line_splited[0]
+                    unpacked_filename = Path(line_splited[0]).as_posix()
                     index = None
-                    if files_rebuild_strategy in ["index", "mixed"]:
+                    if files_rebuild_strategy in ["index", "mixed", "compact"]:
                         if line_splited[1] != "auto":
                             index = line_splited[1]
                             if index[:2] != "0x" or len(index) < 3:
@@ -588,13 +942,12 @@ class Afs:
                                 raise AfsIndexCollisionError("Error - Multiple files using same index: 0x{index:x}")
                             reserved_indexes.append( index )
 
-                    file_path = root_path / unpacked_filename
-                    if not file_path.is_file():
-                        raise AfsInvalidFilePathError(f"Error - File {file_path} doesn't exist.")
-                    file_length = file_path.stat().st_size
+                    if not root_snapshot.is_file(unpacked_filename):
+                        raise AfsInvalidFilePathError(f"Error - File {root_path / unpacked_filename} doesn't exist.")
+                    file_length = root_snapshot.stat(unpacked_filename).st_size
                     
                     offset = None
-                    if files_rebuild_strategy in ["offset", "mixed"]:
+                    if files_rebuild_strategy in ["offset", "mixed", "compact"]:
                         if line_splited[2] != "auto":
                             offset = line_splited[2]
                             if offset[:2] != "0x" or len(offset) < 3:
@@ -605,7 +958,7 @@ class Afs:
 
                     csv_files_lists.append( [unpacked_filename, index, offset, line_splited[3], file_length] )
 
-                    files_paths.remove( root_path / unpacked_filename )
+                    files_paths.remove( unpacked_filename )
                 elif len(line_splited) == 2: # empty block
                     if line_splited[0][:2] != "0x" or line_splited[1][:2] != "0x" or len(line_splited[0]) < 3 or len(line_splited[1]) < 3:
                         raise AfsEmptyBlockValueError(f"Error - Invalid empty block values: \"{line}\"")
@@ -620,25 +973,14 @@ class Afs:
         # We generate file memory map with offsets:
         # available_space_ranges is then used to put files that have an adapted length
         # max_offset is used here to find memory collisions between files and next available space
-        available_space_ranges = []
+        toc_end_offset = max_offset
         tmp_ranges = empty_blocks_list
-        if files_rebuild_strategy in ["offset", "mixed"]:
-            tmp_ranges += csv_files_lists
-
-        # We have to sort offsets before merging to avoid complex algorithm
-        # TOC is already present with max_offset
-        for file_tuple in sorted(tmp_ranges, key=lambda x: (x[2] is not None, x[2])):
-            offset = file_tuple[2]
-            if offset is None:
-                continue
-            if offset < max_offset:
-                raise AfsOffsetCollisionError(f"Error - Offsets collision with offset \"0x{offset:x}\".")
-            elif offset > max_offset:
-                available_space_ranges.append( [max_offset, offset] )
-            max_offset = int(ceil((offset + file_tuple[4]) / Afs.ALIGN)) * Afs.ALIGN
+        if files_rebuild_strategy in ["offset", "mixed", "compact"]:
+            tmp_ranges = empty_blocks_list + csv_files_lists
+        available_space_ranges, max_offset = self.__get_available_space_ranges(tmp_ranges, max_offset)
 
         for file_path in files_paths:
-            csv_files_lists.append( [file_path.name, None, None, file_path.name, file_path.stat().st_size] )
+            csv_files_lists.append( [Path(file_path).name, None, None, Path(file_path).name, root_snapshot.stat(file_path).st_size] )
 
         # sort by filename
         csv_files_lists.sort(key=lambda x: x[3])
@@ -648,7 +990,7 @@ class Afs:
         reserved_indexes.sort()
         next_index = 0
         for i in range(len(csv_files_lists)):
-            if csv_files_lists[i][1] is None and files_rebuild_strategy in ["index", "mixed"] or files_rebuild_strategy in ["auto", "offset"]:
+            if csv_files_lists[i][1] is None and files_rebuild_strategy in ["index", "mixed", "compact"] or files_rebuild_strategy in ["auto", "offset"]:
                 for j in range(next_index, len(csv_files_lists)):
                     if j not in reserved_indexes:
                         next_index = j + 1
@@ -658,22 +1000,24 @@ class Afs:
         csv_files_lists.sort(key=lambda x: x[1])
 
         # if offset==None -> Assign an offset in available_space_ranges or at the end of file allocated space
-        for i in range(len(csv_files_lists)):
-            if files_rebuild_strategy in ["offset", "mixed"] and csv_files_lists[i][2] is None or files_rebuild_strategy in ["auto", "index"]:
-                block_len = int(ceil(csv_files_lists[i][4] / Afs.ALIGN)) * Afs.ALIGN
-                for j in range(len(available_space_ranges)):
-                    available_block_len = int(ceil((available_space_ranges[j][1] - available_space_ranges[j][0]) / Afs.ALIGN)) * Afs.ALIGN
-                    if block_len <= available_block_len:
-                        csv_files_lists[i][2] = available_space_ranges[j][0]
-                        if block_len == available_block_len:
-                            del available_space_ranges[j]
-                        else:
-                            available_space_ranges[j][0] += block_len
-                        break
-                else:
-                    # Here we have a bigger file than available ranges so we pick current_offset at the end of allocated space
-                    csv_files_lists[i][2] = current_offset
-                    current_offset += block_len
+        unpinned_files_lists = [file_list for file_list in csv_files_lists if files_rebuild_strategy in ["offset", "mixed", "compact"] and file_list[2] is None or files_rebuild_strategy in ["auto", "index"]]
+        if files_rebuild_strategy == "compact":
+            # Bin-packing: biggest files first fill the holes left between pinned files (first fit decreasing)
+            # sort is stable so files with the same length stay sorted by index
+            unpinned_files_lists.sort(key=lambda x: x[4], reverse=True)
+            # auto strategy ignore pinned offsets and only keep empty blocks
+            auto_space_ranges, auto_offset = self.__get_available_space_ranges(empty_blocks_list, toc_end_offset)
+            _, auto_offset = self.__allocate_offsets([file_list[4] for file_list in sorted(csv_files_lists, key=lambda x: x[3])], auto_space_ranges, auto_offset)
+
+        offsets, current_offset = self.__allocate_offsets([file_list[4] for file_list in unpinned_files_lists], available_space_ranges, current_offset)
+        for file_list, offset in zip(unpinned_files_lists, offsets):
+            file_list[2] = offset
+
+        if files_rebuild_strategy == "compact":
+            if auto_offset >= current_offset:
+                logging.info(f"compact strategy saved 0x{auto_offset - current_offset:x} bytes compared to auto strategy.")
+            else:
+                logging.info(f"compact strategy use 0x{current_offset - auto_offset:x} more bytes than auto strategy because of pinned offsets.")
 
         if self.__filenamedirectory_offset_offset:
             self.__filenamedirectory = b""
@@ -715,12 +1059,23 @@ class Afs:
             (sys_path / "filenamedirectory.bin").write_bytes(self.__filenamedirectory)
         logging.info(f"Writting {Path('sys/tableofcontent.bin')}")
         (sys_path / "tableofcontent.bin").write_bytes(self.__tableofcontent)
-    def stats(self, path:Path):
+    def status(self, folder_path:Path):
+        "Print files added, removed or modified since the unpack using sys/manifest."
+        manifest = Manifest(folder_path)
+        manifest.load()
+        changes = manifest.get_changes()
+        for change in changes:
+            print(f"{change[0]:8}: {change[1]}")
+        if not changes:
+            logging.info(f"No changes in {folder_path} since unpack.")
+    def stats(self, path:Path, stats_format:str = "txt"):
         """
         Stats will print the AFS stats:
           Get full informations about header, TOC, FD, full memory mapping 
           sorted by offsets (files and sys files), addresses space informations, 
           and duplicated filenames grouped by filenames.
+        stats_format = "txt" for tables, "json" (json lines) or "csv" to stream
+          one record per entry and per empty block.
         """
         if path.is_file():
             with path.open("rb") as afs_file:
@@ -728,58 +1083,64 @@ class Afs:
         else:
             self.__loadsys_from_folder(path / "sys")
 
-        files_map = self.__get_formated_map()
-        files_map.sort(key=lambda x: x[1]) # sort by offset (str with fixed len=8)
+        files_map = self.__get_files_map()
+        files_map.sort(key=lambda x: x[1]) # sort by offset
+        offsets = [file_tuple[1] for file_tuple in files_map]
+        end_offsets = [file_tuple[1] + file_tuple[2] for file_tuple in files_map]
 
-        # Offsets intersect
-        dup_offsets_tuples = []
-        last_tuple = (-1, "-1", "0") # empty space search init
+        # Offsets intersect: sets of positions in files_map
+        # max_end_pos is the position of the entry with the max end offset before the current one
+        overlap_sets = []
+        overlap_flags = [False] * len(files_map)
         new_set = True
-        # Filenames duplicates
-        dup_names_dict = {} # tmp dict for grouping by filename
-        dup_names_tuples = []
-        # For empty blocks
-        empty_space_tuples = []
-        for file_tuple in files_map:
-            # Filenames duplicates
-            if not file_tuple[6] in dup_names_dict:
-                dup_names_dict[file_tuple[6]] = [file_tuple]
-            else:
-                dup_names_dict[file_tuple[6]].append(file_tuple)
+        # For empty blocks: {position of the previous entry: (begin offset, end offset)}
+        empty_blocks = {}
+        max_end_pos = 0
+        for pos in range(1, len(files_map)):
             # Offsets intersect
-            if file_tuple[1] < last_tuple[1]:
+            if offsets[pos] < end_offsets[max_end_pos]:
                 if new_set:
-                    dup_offsets_tuples.append("Files sharing same offsets:\n")
+                    overlap_sets.append([max_end_pos])
+                    overlap_flags[max_end_pos] = True
                     new_set = False
-                dup_offsets_tuples.append(file_tuple)
+                overlap_sets[-1].append(pos)
+                overlap_flags[pos] = True
             else:
                 new_set = True
             # Empty blocks
-            last_block_end = ceil(int(last_tuple[2], base=16) / Afs.ALIGN) * Afs.ALIGN
-            if int(file_tuple[1], base=16) - last_block_end >= Afs.ALIGN:
-                empty_space_tuples.append( (last_tuple[2], file_tuple[1], f"{int(file_tuple[1], base=16) - int(last_tuple[2], base=16):08x}", file_tuple[6]) )
-            last_tuple = file_tuple
+            last_block_end = ceil(end_offsets[max_end_pos] / Afs.ALIGN) * Afs.ALIGN
+            if offsets[pos] - last_block_end >= Afs.ALIGN:
+                empty_blocks[pos - 1] = (end_offsets[max_end_pos], offsets[pos])
+            if end_offsets[pos] > end_offsets[max_end_pos]:
+                max_end_pos = pos
 
-        for filename in dup_names_dict:
-            if len(dup_names_dict[filename]) > 1:
-                dup_names_tuples += ["Files sharing same name:\n"] + [file_tuple for file_tuple in dup_names_dict[filename]]
+        # Filenames duplicates
+        dup_names_dict = {} # tmp dict for grouping positions by filename
+        for pos, file_tuple in enumerate(files_map):
+            dup_names_dict.setdefault(file_tuple[5], []).append(pos)
+        dup_names_sets = [positions for positions in dup_names_dict.values() if len(positions) > 1]
+        dup_name_flags = [len(dup_names_dict[file_tuple[5]]) > 1 for file_tuple in files_map]
 
-        dup_offsets = "Yes" if len(dup_offsets_tuples) > 1 else "No"
-        dup_names   = "Yes" if len(dup_names_tuples) > 1 else "No"
-        empty_space = "Yes" if len(empty_space_tuples) > 1 else "No"
+        if stats_format != "txt":
+            self.__print_records(path, stats_format, files_map, overlap_flags, dup_name_flags, empty_blocks)
+            return
 
         files_info =  f"AFS Magic/Version                : {str(self.__get_magic())[2:-1]}\n"
         files_info += f"TOC offset of the FD offset      : 0x{self.__filenamedirectory_offset_offset:x}\n" if self.__filenamedirectory else ""
-        files_info += f"Multiple files using same offsets: {dup_offsets}\n"
-        files_info += f"Multiple files using same name   : {dup_names}\n" if self.__filenamedirectory else ""
-        files_info += f"Empty blocks                     : {empty_space}\n"
-        self.__print("Global infos and AFS space mapping:", files_map, infos=files_info)
-        if dup_offsets_tuples:
-            self.__print("Files sharing same AFS offsets:", dup_offsets_tuples)
-        if dup_names_tuples:
-            self.__print("Files using same filenames:", dup_names_tuples)
-        if empty_space_tuples:
-            self.__print("Empty blocks between files (filename = name of the previous file):", empty_space_tuples, columns=[1,2,3,6])
+        files_info += f"Multiple files using same offsets: {'Yes' if overlap_sets else 'No'}\n"
+        files_info += f"Multiple files using same name   : {'Yes' if dup_names_sets else 'No'}\n" if self.__filenamedirectory else ""
+        files_info += f"Empty blocks                     : {'Yes' if empty_blocks else 'No'}\n"
+        self.__print("Global infos and AFS space mapping:", map(self.__format_file_tuple, files_map), infos=files_info)
+        if overlap_sets:
+            self.__print("Files sharing same AFS offsets:", (line for positions in overlap_sets \
+                for line in ["Files sharing same offsets:\n"] + [self.__format_file_tuple(files_map[pos]) for pos in positions]))
+        if dup_names_sets:
+            self.__print("Files using same filenames:", (line for positions in dup_names_sets \
+                for line in ["Files sharing same name:\n"] + [self.__format_file_tuple(files_map[pos]) for pos in positions]))
+        if empty_blocks:
+            self.__print("Empty blocks between files (filename = name of the previous file):", \
+                ((f"{empty_offset:08x}", f"{empty_end_offset:08x}", f"{empty_end_offset - empty_offset:08x}", files_map[pos][5]) \
+                for pos, (empty_offset, empty_end_offset) in empty_blocks.items()), columns=[1,2,3,6])
 
 
 def get_argparser():
@@ -787,6 +1148,7 @@ def get_argparser():
     parser = argparse.ArgumentParser(description='AFS packer & unpacker - [GameCube] v' + __version__)
     parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
     parser.add_argument('-v', '--verbose', action='store_true', help='verbose mode')
+    parser.add_argument('-f', '--format', choices=["txt", "json", "csv"], default="txt", help="-f json: stats output format - txt tables (default), json lines or csv records.")
     parser.add_argument('input_path',  metavar='INPUT', help='')
     parser.add_argument('output_path', metavar='OUTPUT', help='', nargs='?', default="")
 
@@ -795,6 +1157,9 @@ def get_argparser():
     group.add_argument('-u', '--unpack',  action='store_true', help="-u source_afs.afs (dest_folder): Unpack the AFS in new folder source_afs or dest_folder if specified.")
     group.add_argument('-s', '--stats',   action='store_true', help="-s source_afs.afs or source_folder: Get stats about AFS, files, memory, lengths and offsets.")
     group.add_argument('-r', '--rebuild', action='store_true', help="-r source_folder: Rebuild AFS tableofcontent (TOC) and filenamedirectory (FD) using afs_rebuild.conf file and afs_rebuild.csv.")
+    group.add_argument('-st', '--status',  action='store_true', help="-st source_folder: List files added, removed or modified since unpack using sys/manifest.")
+    group.add_argument('-rl', '--replace', action='store_true', help="-rl source_afs.afs manifest.csv dest_afs.afs: Write a new AFS replacing files listed in manifest.csv without unpacking.")
+    parser.add_argument('third_path', metavar='DEST', help='', nargs='?', default="")
     return parser
 
 
@@ -822,9 +1187,16 @@ if __name__ == '__main__':
         logging.info(f"unpacking AFS {p_input} in {p_output}")
         afs.unpack( p_input, p_output )
     elif args.stats:
-        afs.stats(p_input)
+        afs.stats(p_input, args.format)
     elif args.rebuild:
         if not (p_input / "sys").is_dir():
             raise AfsInvalidAfsFolderError(f"Error - Invalid unpacked AFS: {p_input}.")
         logging.info(f"rebuilding {p_input}")
         afs.rebuild(p_input)
+    elif args.status:
+        afs.status(p_input)
+    elif args.replace:
+        if args.third_path == "":
+            raise AfsInvalidFilePathError("Error - Missing dest AFS: use -rl source_afs.afs manifest.csv dest_afs.afs.")
+        logging.info(f"replacing files of AFS {p_input} using {p_output} in {args.third_path}")
+        afs.replace(p_input, p_output, Path(args.third_path))
@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
 from configparser import ConfigParser
-from gcmtool import Gcm, align_top
+from gcmtool import Gcm, GcmImage, Manifest, align_top
 from gcmtool import InvalidDVDMagicError, InvalidUnpackFolderError, InvalidPackIsoError, \
     InvalidFSTSizeError, DolSizeOverflowError, InvalidRootFileFolderCountError, \
     InvalidFSTFileSizeError, FSTDirNotFoundError, FSTFileNotFoundError, BadAlignError, \
-    FstSizeOverflowError, InvalidConfValueError, ApploaderOverflowError
+    FstSizeOverflowError, InvalidConfValueError, ApploaderOverflowError, PatchFstModifiedError
+import filecmp
 import os
 from pathlib import Path
 import shutil
@@ -104,8 +105,8 @@ def compare_GCM(folder1: Path, folder2: Path):
 ##################################################
 # gcmtool.py commands wrappers
 ##################################################
-def gcmtool_unpack(iso_path:Path, folder_path:Path):
-    if os.system(f"python gcmtool.py -u \"{iso_path}\" \"{folder_path}\"") != 0:
+def gcmtool_unpack(iso_path:Path, folder_path:Path, jobs:int = 1):
+    if os.system(f"python gcmtool.py -u -j {jobs} \"{iso_path}\" \"{folder_path}\"") != 0:
         raise Exception("Error while unpacking GCM.")
 def gcmtool_pack(folder_path:Path, iso_path:Path, disable_ignore:bool = False):
     if os.system(f"python gcmtool.py -p {'-di' if disable_ignore else ''} \"{folder_path}\" \"{iso_path}\"") != 0:
@@ -113,12 +114,21 @@ def gcmtool_pack(folder_path:Path, iso_path:Path, disable_ignore:bool = False):
 def gcmtool_rebuild_fst(folder_path:Path):
     if os.system(f"python gcmtool.py -r \"{folder_path}\"") != 0:
         raise Exception("Error while rebuilding FST.")
+def gcmtool_diff(iso_path:Path, modded_iso_path:Path, patch_path:Path):
+    if os.system(f"python gcmtool.py -df \"{iso_path}\" \"{modded_iso_path}\" \"{patch_path}\"") != 0:
+        raise Exception("Error while diffing GCM.")
+def gcmtool_apply_patch(iso_path:Path, patch_path:Path, patched_iso_path:Path):
+    if os.system(f"python gcmtool.py -ap \"{iso_path}\" \"{patch_path}\" \"{patched_iso_path}\"") != 0:
+        raise Exception("Error while applying GCM patch.")
+def gcmtool_patch(iso_path:Path, folder_path:Path):
+    if os.system(f"python gcmtool.py -pa \"{iso_path}\" \"{folder_path}\"") != 0:
+        raise Exception("Error while patching GCM.")
 def gcmtool_stats(path:Path):
     if os.system(f"python gcmtool.py -s \"{path}\" > NUL") != 0:
         raise Exception("Error while getting stats.")
 
 
-TEST_COUNT = 7
+TEST_COUNT = 8
 
 
 start = time()
@@ -144,6 +154,37 @@ for iso_path in roms_path.glob("*"):
 # compare unpack_path dolphin_unpack_path
 for folder_path in unpack_path.glob("*"):
     compare_GCM(folder_path, dolphin_unpack_path / folder_path.name)
+    # sys/manifest must match the freshly unpacked folder
+    manifest = Manifest(folder_path)
+    manifest.load()
+    if manifest.get_changes():
+        raise Exception(f"Error - Invalid sys/manifest in \"{folder_path}\": {manifest.get_changes()}.")
+
+# unpack with threads must give the same folders than with --jobs 1
+unpack2_path.mkdir()
+for iso_path in roms_path.glob("*"):
+    if iso_path.is_file():
+        gcmtool_unpack(iso_path, unpack2_path / iso_path.name, jobs = 4)
+        compare_GCM(unpack_path / iso_path.name, unpack2_path / iso_path.name)
+        # manifests entries without mtimes: {relative_path: (offset, length, crc32), ...}
+        entries_list = []
+        for folder_path in (unpack_path / iso_path.name, unpack2_path / iso_path.name):
+            manifest = Manifest(folder_path)
+            manifest.load()
+            entries_list.append({path: (offset, length, crc32) for path, (offset, length, _, crc32) in manifest.entries().items()})
+        if entries_list[0] != entries_list[1]:
+            raise Exception(f"Error - sys/manifest of \"{iso_path}\" unpacked with --jobs 4 is different.")
+shutil.rmtree(unpack2_path)
+
+# GcmImage files must match unpacked files without unpacking
+for iso_path in roms_path.glob("*"):
+    if iso_path.is_file():
+        with GcmImage(iso_path) as gcm_image:
+            for dirpath, _, filenames in gcm_image.walk():
+                for filename in filenames:
+                    with gcm_image.open(f"{dirpath}/{filename}") as image_file:
+                        if image_file.read() != (unpack_path / iso_path.name / dirpath / filename).read_bytes():
+                            raise Exception(f"Error - GcmImage \"{iso_path}\" {dirpath}/{filename} is different from the unpacked file.")
 
 print("###############################################################################")
 print(f"# TEST 2/{TEST_COUNT}")
@@ -158,7 +199,7 @@ for folder_path in unpack_path.glob("*"):
 
 print("###############################################################################")
 print(f"# TEST 3/{TEST_COUNT}")
-print("# Comparing [unpack_path]->pack->unpack->[unpack2_path]")
+print("# Comparing [unpack_path]->pack->unpack->[unpack2_path] (iso and ciso)")
 print("###############################################################################")
 # repack unpack_path repack_path
 repack_path.mkdir()
@@ -171,6 +212,13 @@ unpack2_path.mkdir()
 for iso_path in repack_path.glob("*"):
     gcmtool_unpack(iso_path, unpack2_path / iso_path.name)
 
+# packed isos must have the same files hashes than unpacked folders
+for folder_path in unpack_paths:
+    hash_path = repack_path / f"{folder_path.name}.hash"
+    Gcm().hash(folder_path, hash_path, os.cpu_count())
+    if Gcm().verify(hash_path, repack_path / folder_path.name, os.cpu_count()):
+        raise Exception(f"Error - \"{repack_path / folder_path.name}\" files hashes are different from \"{folder_path}\".")
+
 # remove repack_path
 shutil.rmtree(repack_path)
 
@@ -181,9 +229,20 @@ for folder_path in unpack_paths:
 # remove unpack2_path
 shutil.rmtree(unpack2_path)
 
+# same round trip with CISO images: [unpack_path]->pack->ciso->unpack->[unpack2_path]
+repack_path.mkdir()
+unpack2_path.mkdir()
+for folder_path in unpack_paths:
+    ciso_path = repack_path / f"{folder_path.name}.ciso"
+    gcmtool_pack(folder_path, ciso_path, disable_ignore = folder_path.name == "Metroid Prime (USA).iso")
+    gcmtool_unpack(ciso_path, unpack2_path / folder_path.name)
+    compare_GCM(folder_path, unpack2_path / folder_path.name)
+shutil.rmtree(repack_path)
+shutil.rmtree(unpack2_path)
+
 print("###############################################################################")
 print(f"# TEST 4/{TEST_COUNT}")
-print("# Comparing [unpack_path]->rebuild_fst->repack->unpack->[unpack2_path]")
+print("# Comparing [unpack_path]->rebuild_fst->repack->unpack->[unpack2_path] and roms_path->diff->apply_patch with repack_path")
 print("###############################################################################")
 # rebuild unpack_path FSTs
 unpack_paths = list(unpack_path.glob("*"))
@@ -204,6 +263,17 @@ for iso_path in repack_path.glob("*"):
 for folder_path in unpack_path.glob("*"):
     compare_GCM(folder_path, unpack2_path / folder_path.name)
 
+# diff roms_path repack_path then apply the patch on roms_path and compare with repack_path
+patch_path = Path("patch.gcmpatch")
+patched_path = Path("patched.iso")
+for iso_path in repack_path.glob("*"):
+    gcmtool_diff(roms_path / iso_path.name, iso_path, patch_path)
+    gcmtool_apply_patch(roms_path / iso_path.name, patch_path, patched_path)
+    if not filecmp.cmp(iso_path, patched_path, shallow=False):
+        raise Exception(f"Error - patched \"{iso_path.name}\" is different from the rebuilt GCM.")
+patch_path.unlink()
+patched_path.unlink()
+
 # remove unpack2_path
 shutil.rmtree(unpack_path)
 shutil.rmtree(unpack2_path)
@@ -832,6 +902,51 @@ with (repack_path / "ok6.iso").open("rb") as repack_file:
         raise Exception("Error - Invalid repacked iso.")
 print("Correct constrained dol after FST with fixed length.")
 
+print("###############################################################################")
+print(f"# TEST 8/{TEST_COUNT}")
+print("# Testing patch in place: roms_path->unpack->edit->patch->unpack->[unpack2_path]")
+print("###############################################################################")
+for iso_path in roms_path.glob("*"):
+    if iso_path.is_file():
+        patched_iso_path = repack_path / iso_path.name
+        shutil.copyfile(iso_path, patched_iso_path)
+        patched_folder_path = unpack_path / f"patched_{iso_path.name}"
+        gcmtool_unpack(patched_iso_path, patched_folder_path)
+        break
+
+# a shorter file always fits in its slot
+for path in (patched_folder_path / "root").glob("**/*"):
+    if path.is_file() and path.stat().st_size > 1:
+        path.write_bytes(path.read_bytes()[:path.stat().st_size // 2])
+        break
+gcmtool_patch(patched_iso_path, patched_folder_path)
+
+manifest = Manifest(patched_folder_path)
+manifest.load()
+if manifest.get_changes():
+    raise Exception(f"Error - Invalid sys/manifest after patch in \"{patched_folder_path}\": {manifest.get_changes()}.")
+unpack2_path.mkdir()
+gcmtool_unpack(patched_iso_path, unpack2_path / iso_path.name)
+compare_GCM(patched_folder_path, unpack2_path / iso_path.name)
+if (patched_folder_path / "sys/fst.bin").read_bytes() != (unpack2_path / iso_path.name / "sys/fst.bin").read_bytes():
+    raise Exception("Error - sys/fst.bin of the unpacked folder is different from the FST of the patched GCM/iso.")
+shutil.rmtree(unpack2_path)
+print("Correct patched GCM/iso.")
+
+# patch must not write anything when sys/fst.bin has been rebuilt since unpack
+hash_path = repack_path / f"{iso_path.name}.hash"
+Gcm().hash(patched_iso_path, hash_path, os.cpu_count())
+path.write_bytes(path.read_bytes() * 4)
+gcmtool_rebuild_fst(patched_folder_path)
+path.write_bytes(path.read_bytes()[:1])
+try:
+    Gcm().patch(patched_iso_path, patched_folder_path)
+    raise Exception("Error - PatchFstModifiedError should have been triggered.")
+except PatchFstModifiedError:
+    print("Correct PatchFstModifiedError triggered.")
+if Gcm().verify(hash_path, patched_iso_path, os.cpu_count()):
+    raise Exception(f"Error - \"{patched_iso_path}\" has been modified by a refused patch.")
+
 print("###############################################################################")
 print(f"# Cleaning test folders.")
 print("###############################################################################")
@@ -1,8 +1,22 @@
 #!/usr/bin/env python3
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
+from fnmatch import fnmatchcase
+from heapq import heappop, heappush
+import hashlib
+import io
+import json
 import logging
+import mmap
+import os
 from pathlib import Path
 import re
+import struct
+import threading
+import weakref
+import zlib
 
 
 __version__ = "0.2.1"
@@ -33,10 +47,26 @@ class FSTDirNotFoundError(Exception): pass
 class FSTFileNotFoundError(Exception): pass
 # raised when using an invalid align
 class BadAlignError(Exception): pass
+# raised when using an invalid jobs count
+class BadJobsError(Exception): pass
 # raised when a system conf entry has an invalid format
 class InvalidConfValueError(Exception): pass
 # raised when apploader overflow on dol or fst
 class ApploaderOverflowError(Exception): pass
+# raised when an overlay path is a file in the FST and a folder in the changes folder or the opposite
+class InvalidOverlayPathError(Exception): pass
+# raised when sys/manifest is not found in the unpacked folder
+class ManifestNotFoundError(Exception): pass
+# raised when patching a GCM/iso with a FST different than the one of the unpacked folder
+class PatchIsoMismatchError(Exception): pass
+# raised when patching a GCM/iso from an unpacked folder with a sys/fst.bin modified since unpack
+class PatchFstModifiedError(Exception): pass
+# raised when applying a file which isn't a GcmPatch or with an unsupported version
+class InvalidPatchError(Exception): pass
+# raised when an extracted file already exist to avoid erasing it
+class InvalidExtractPathError(Exception): pass
+# raised when a command needing a plain GCM/iso is used on a CISO file
+class CisoNotSupportedError(Exception): pass
 
 
 def align_top(offset:int, align:int):
@@ -50,12 +80,297 @@ def align_top(offset:int, align:int):
     return offset + align - (offset % align)
 
 
+def get_file_sha1(file_path:Path):
+    "Compute the sha1 digest of a file by blocks."
+    sha1 = hashlib.sha1()
+    with file_path.open("rb") as file:
+        data = file.read(Manifest.BLOCK_LEN)
+        while data:
+            sha1.update(data)
+            data = file.read(Manifest.BLOCK_LEN)
+    return sha1.digest()
+
+
+def get_file_crc32(file_path:Path):
+    "Compute the crc32 of a file by blocks."
+    crc32 = 0
+    with file_path.open("rb") as file:
+        data = file.read(Manifest.BLOCK_LEN)
+        while data:
+            crc32 = zlib.crc32(data, crc32)
+            data = file.read(Manifest.BLOCK_LEN)
+    return crc32
+
+
+class Manifest:
+    """
+    Manifest describe the sys/manifest file written at the end of unpack.
+    Each line contains "relative_path?offset?length?mtime?crc32" for each
+    extracted file (sys and root files) with relative_path from the unpacked
+    folder. The crc32 is computed while the data is in memory so finding
+    modified files doesn't need to read the original GCM/iso again. Files
+    with the same length and mtime are considered unchanged without reading them.
+    Constructor:
+    * folder_path = Path of the unpacked GCM/iso
+    """
+    BLOCK_LEN = 0x100000
+    __folder_path = None
+    # entries_dict: {relative_path: (offset, length, mtime, crc32), ... }
+    __entries_dict = None
+    __separator = '?'
+    def __init__(self, folder_path:Path):
+        self.__folder_path = folder_path
+        self.__entries_dict = {}
+    def entries(self): return self.__entries_dict
+    def add(self, relative_path:str, offset:int, data:bytes):
+        "Add an extracted file using data to compute the crc32."
+        self.add_crc32(relative_path, offset, len(data), zlib.crc32(data))
+    def add_crc32(self, relative_path:str, offset:int, length:int, crc32:int):
+        "Add an extracted file with a crc32 computed while copying it."
+        mtime = (self.__folder_path / relative_path).stat().st_mtime
+        self.__entries_dict[relative_path] = (offset, length, round(mtime), crc32)
+    def save(self):
+        (self.__folder_path / "sys" / "manifest").write_text("\n".join(
+            f"{path}{self.__separator}0x{offset:x}{self.__separator}0x{length:x}{self.__separator}{mtime}{self.__separator}{crc32:08x}" \
+            for path, (offset, length, mtime, crc32) in self.__entries_dict.items()))
+        logging.info("sys/manifest saved.")
+    def load(self):
+        if not (self.__folder_path / "sys" / "manifest").is_file():
+            raise ManifestNotFoundError(f"Error - {self.__folder_path / 'sys' / 'manifest'} not found. Unpack the GCM/iso again to generate it.")
+        for line in (self.__folder_path / "sys" / "manifest").read_text().split('\n'):
+            if line == "":
+                continue
+            (path, offset, length, mtime, crc32) = line.rsplit(self.__separator, 4)
+            self.__entries_dict[path] = (int(offset, 16), int(length, 16), int(mtime), int(crc32, 16))
+    def is_unchanged(self, relative_path:str, file_stat:os.stat_result = None):
+        """
+        input: relative_path = str
+        input: file_stat = os.stat_result if already known
+        return True if the file has the same length and (mtime or crc32) than when unpacked
+        """
+        if relative_path not in self.__entries_dict:
+            return False
+        (offset, length, mtime, crc32) = self.__entries_dict[relative_path]
+        if file_stat is None:
+            file_stat = (self.__folder_path / relative_path).stat()
+        if file_stat.st_size != length:
+            return False
+        return round(file_stat.st_mtime) == mtime or get_file_crc32(self.__folder_path / relative_path) == crc32
+    def get_changes(self):
+        """
+        Compare the unpacked folder with the manifest.
+        return [(status, relative_path), ...] with status = "modified", "removed" or "added"
+        """
+        changes = []
+        for relative_path in self.__entries_dict:
+            file_path = self.__folder_path / relative_path
+            if not file_path.is_file():
+                changes.append( ("removed", relative_path) )
+            elif not self.is_unchanged(relative_path, file_path.stat()):
+                changes.append( ("modified", relative_path) )
+        for file_path in (self.__folder_path / "root").glob("**/*"):
+            relative_path = file_path.relative_to(self.__folder_path).as_posix()
+            if relative_path not in self.__entries_dict and file_path.is_file():
+                changes.append( ("added", relative_path) )
+        return changes
+
+
+def get_file_hashes(file, buffer:memoryview):
+    """
+    Compute the crc32 and the sha1 of a binary file object reading it by blocks.
+    input: file = binary file object
+    input: buffer = memoryview used for reads
+    return (length:int, crc32:int, sha1:str)
+    """
+    length = 0
+    crc32 = 0
+    sha1 = hashlib.sha1()
+    read_len = file.readinto(buffer)
+    while read_len:
+        crc32 = zlib.crc32(buffer[:read_len], crc32)
+        sha1.update(buffer[:read_len])
+        length += read_len
+        read_len = file.readinto(buffer)
+    return (length, crc32, sha1.hexdigest())
+
+
+def get_match_len(src:memoryview, src_offset:int, dst:memoryview, dst_offset:int):
+    """
+    Give the length of the same data in src from src_offset and in dst from dst_offset.
+    Slices are compared by blocks then the first different byte is found by dichotomy.
+    return length = int
+    """
+    max_len = min(len(src) - src_offset, len(dst) - dst_offset)
+    length = 0
+    while length < max_len:
+        block_len = min(0x1000, max_len - length)
+        if src[src_offset + length:src_offset + length + block_len] == dst[dst_offset + length:dst_offset + length + block_len]:
+            length += block_len
+            continue
+        while block_len > 1:
+            half_len = block_len // 2
+            if src[src_offset + length:src_offset + length + half_len] == dst[dst_offset + length:dst_offset + length + half_len]:
+                length += half_len
+                block_len -= half_len
+            else:
+                block_len = half_len
+        break
+    return length
+
+
+def get_delta_ops(src:memoryview, dst:memoryview, block_len:int):
+    """
+    Find data of dst already in src using a rolling hash (adler32) over block_len windows of dst
+    and an index of src blocks. Matches are checked then extended forward so shifted data still match.
+    input: src = memoryview of the original data
+    input: dst = memoryview of the new data
+    input: block_len = int
+    return [(GcmPatch.OP_COPY, src_offset, length) or (GcmPatch.OP_INSERT, dst_offset, length), ...]
+    """
+    # index: {adler32: src_offset, ... } of src aligned blocks
+    index = {}
+    for src_offset in range(len(src) - block_len, -1, -block_len):
+        index[zlib.adler32(src[src_offset:src_offset + block_len])] = src_offset
+
+    ops = []
+    insert_offset = 0
+    dst_offset = 0
+    weak_hash = None
+    while dst_offset + block_len <= len(dst):
+        if weak_hash is None:
+            weak_hash = zlib.adler32(dst[dst_offset:dst_offset + block_len])
+        src_offset = index.get(weak_hash)
+        if src_offset is not None and src[src_offset:src_offset + block_len] == dst[dst_offset:dst_offset + block_len]:
+            if insert_offset < dst_offset:
+                ops.append( (GcmPatch.OP_INSERT, insert_offset, dst_offset - insert_offset) )
+            match_len = get_match_len(src, src_offset, dst, dst_offset)
+            ops.append( (GcmPatch.OP_COPY, src_offset, match_len) )
+            dst_offset += match_len
+            insert_offset = dst_offset
+            weak_hash = None
+            continue
+        if dst_offset + block_len == len(dst):
+            break
+        # roll the adler32 one byte forward
+        out_byte = dst[dst_offset]
+        a = ((weak_hash & 0xffff) - out_byte + dst[dst_offset + block_len]) % 65521
+        b = ((weak_hash >> 16) - block_len * out_byte + a - 1) % 65521
+        weak_hash = (b << 16) | a
+        dst_offset += 1
+    if insert_offset < len(dst):
+        ops.append( (GcmPatch.OP_INSERT, insert_offset, len(dst) - insert_offset) )
+    return ops
+
+
+class HashManifest:
+    """
+    HashManifest describe a list of files hashes written by the --hash command.
+    Each line contains "relative_path?length?crc32?sha1" for each system file
+    and FST file with relative_path from the top of the unpacked folder tree
+    ("sys/boot.dol", "root/path/in/fst"). It's the same for a GCM/iso and its
+    unpacked folder so it can be verified against both.
+    """
+    # entries_dict: {relative_path: (length, crc32, sha1), ... }
+    __entries_dict = None
+    __separator = '?'
+    def __init__(self): self.__entries_dict = {}
+    def entries(self): return self.__entries_dict
+    def add(self, relative_path:str, length:int, crc32:int, sha1:str):
+        self.__entries_dict[relative_path] = (length, crc32, sha1)
+    def save(self, manifest_path:Path):
+        manifest_path.write_text("\n".join(
+            f"{path}{self.__separator}0x{length:x}{self.__separator}{crc32:08x}{self.__separator}{sha1}" \
+            for path, (length, crc32, sha1) in sorted(self.__entries_dict.items())))
+        logging.info(f"{manifest_path} saved.")
+    def load(self, manifest_path:Path):
+        if not manifest_path.is_file():
+            raise ManifestNotFoundError(f"Error - {manifest_path} not found. Use --hash to generate it.")
+        for line in manifest_path.read_text().split('\n'):
+            if line == "":
+                continue
+            (path, length, crc32, sha1) = line.rsplit(self.__separator, 3)
+            self.__entries_dict[path] = (int(length, 16), int(crc32, 16), sha1)
+    def get_differences(self, hash_manifest):
+        """
+        Compare files of another HashManifest with this one.
+        input: hash_manifest = HashManifest
+        return [(status, relative_path), ...] with status = "modified", "removed" or "added"
+        """
+        differences = []
+        for relative_path, hashes in self.__entries_dict.items():
+            if relative_path not in hash_manifest.entries():
+                differences.append( ("removed", relative_path) )
+            elif hash_manifest.entries()[relative_path] != hashes:
+                differences.append( ("modified", relative_path) )
+        for relative_path in hash_manifest.entries():
+            if relative_path not in self.__entries_dict:
+                differences.append( ("added", relative_path) )
+        return differences
+
+
+class GcmPatch:
+    """
+    GcmPatch describe the binary patch written by --diff and applied by --apply-patch.
+    * header: magic, version, original GCM/iso length, original fst.bin crc32, new GCM/iso length
+    * records sorted by new GCM/iso offsets: type, dest_offset, length and
+        * RECORD_RAW: length bytes of data
+        * RECORD_COPY: src_offset in the original GCM/iso
+        * RECORD_DELTA: src_offset in the original GCM/iso then ops until OP_END:
+            * OP_COPY: src_offset relative to the record src_offset, length
+            * OP_INSERT: length and length bytes of data
+    * RECORD_END
+    Spaces between records are zeros. All values are big endian.
+    """
+    MAGIC = b"GCMPATCH"
+    VERSION = 1
+    HEADER_STRUCT = struct.Struct(">8sIQIQ")
+    RECORD_STRUCT = struct.Struct(">BQQ")
+    OFFSET_STRUCT = struct.Struct(">Q")
+    OP_STRUCT = struct.Struct(">BQ")
+    RECORD_END = 0
+    RECORD_RAW = 1
+    RECORD_COPY = 2
+    RECORD_DELTA = 3
+    OP_END = 0
+    OP_COPY = 1
+    OP_INSERT = 2
+
+
 class Fst:
     "Pack FST type enum values."
     TYPE_FILE = 0
     TYPE_DIR = 1
 
 
+class FolderSnapshot:
+    """
+    FolderSnapshot walk a folder once using os.scandir and keep for each
+    entry its type and size: {relative_path: (type, size), ... } with
+    relative_path using "/" as separator. Folders use the Fst types and a
+    size of 0. On Windows sizes come with the directory listing so there
+    is no stat syscall per file.
+    Constructor: folder_path = Path
+    """
+    # entries_dict: {relative_path: (type, size), ... }
+    __entries_dict = None
+    def __init__(self, folder_path:Path):
+        self.__entries_dict = {}
+        self.__scan(folder_path, "")
+    def __scan(self, path:Path, prefix:str):
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    self.__entries_dict[prefix + entry.name] = (Fst.TYPE_DIR, 0)
+                    self.__scan(entry.path, f"{prefix}{entry.name}/")
+                else:
+                    self.__entries_dict[prefix + entry.name] = (Fst.TYPE_FILE, entry.stat().st_size)
+    def get(self, relative_path:str):
+        "return (type, size) or None if the path is not in the folder"
+        return self.__entries_dict.get(relative_path)
+    def paths(self):
+        return list(self.__entries_dict)
+
+
 class Node:
     """
     Interface Node used to be herited by File and Folder classes.
@@ -120,22 +435,29 @@ class Folder(Node):
     __parent = None
     __next_dir = None
     __childs = None
+    # childs_dict: {name: Node, ... } to find existing childs in constant time
+    __childs_dict = None
+    # total count of childs and theirs childs, set by FstTree before preparing the FST
+    __descendants_count = None
     def __init__(self, name:str, parent:Node):
         super().__init__(name)
         self.__parent = parent
         self.__childs = []
+        self.__childs_dict = {}
     def __str__(self):
         return f"{self.id()};{self.name()};{self.next_dir()};{self.name_offset()}"
     def type(self):                   return self.__type
     def parent(self):                 return self.__parent
     def next_dir(self):               return self.__next_dir
     def childs(self):                 return self.__childs
+    def descendants_count(self):      return self.__descendants_count
     def set_next_dir(self, next_dir): self.__next_dir = next_dir
+    def set_descendants_count(self, descendants_count:int): self.__descendants_count = descendants_count
     def add_child(self, node:Node):
         "Search child by name an return existing if found or new if not existing"
-        for child in self.__childs:
-            if node.name() == child.name():
-                return child
+        if node.name() in self.__childs_dict:
+            return self.__childs_dict[node.name()]
+        self.__childs_dict[node.name()] = node
         self.__childs.append(node)
         return node
     def format(self):
@@ -165,20 +487,35 @@ class FstTree(Fst):
     __name_block = None
     # Used to find min file_offset when fst is at the end of the iso beginning (otherweise we can't know the first available offset)
     __nameblock_length = None
+    # Next name offset in the name_block while preparing
+    __name_offset = None
     __user_position = None
     __user_length = None
     # FST high tell if fst is after dol
     __is_fst_last = None
+    # files: [(File, path), ...] in id order, offsets are allocated after preparing all Nodes
+    __files = None
+    # preserved_offsets: {path: offset, ... } of the previous FST when preserving the layout
+    __preserved_offsets = None
+    __moved_length = None
+    # files_order: {path: rank, ... } data layout order of files, others files are put after in id order
+    __files_order = None
+    # align_rules: [(glob_pattern, align), ... ] files alignments, others files use align
+    __align_rules = None
+    # duplicates: {path: source_path, ... } files with the same content than source_path sharing its data
+    __duplicates = None
     def __init__(self, root_path:Path, offset:int, is_fst_last:bool, align:int = 4):
         # as said before we don't want to add parents folder that don't are used in the folder we are packing.
         self.__root_path_length = len(root_path.parts)
         self.__root_node = Folder(root_path.name, None)
         self.__align = align
-        self.__name_block = b""
-        self.__fst_block = b""
+        self.__name_block = bytearray()
+        self.__fst_block = bytearray()
         self.__nameblock_length = 0
         self.__current_file_offset = offset
         self.__is_fst_last = is_fst_last
+        self.__align_rules = []
+        self.__duplicates = {}
     def __str__(self):
         return self.__to_str(self.__root_node)
     def __to_str(self, node:Node, depth=0):
@@ -197,64 +534,137 @@ class FstTree(Fst):
         Needed to know where we can begin to write files.
         return fst_length = int
         """
-        self.__generate_nameblock_length()
-        return align_top(self.__count_childs(self.__root_node)*12 + 12 + self.__nameblock_length, self.__align)
-    def __generate_nameblock_length(self, node:Node = None):
+        return align_top(self.__root_node.descendants_count()*12 + 12 + self.__nameblock_length, self.__align)
+    def __count_descendants(self, node:Folder):
         """
-        Recursive walk into the tree to get total name_block length.
-        input: None (then it will use node:Node to recurse)
+        Post-order walk setting the descendants count of every Folder and the total name_block length.
+        Each Node is visited once.
+        input: node = Folder
+        return descendants_count = int
         """
-        if node is None:
-            node = self.__root_node
-        else:
-            self.__nameblock_length += len(node.name()) + 1
-        if node.type() == FstTree.TYPE_DIR:
-            for child in node.childs():
-                self.__generate_nameblock_length(child)
-    def __prepare(self, node:Node = None):
+        count = len(node.childs())
+        for child in node.childs():
+            self.__nameblock_length += len(child.name().encode("utf-8")) + 1
+            if child.type() == FstTree.TYPE_DIR:
+                count += self.__count_descendants(child)
+        node.set_descendants_count(count)
+        return count
+    def __prepare(self, node:Node = None, path:str = ""):
         """
-        Populate recursivly every Nodes with required informations for formating and generate the name_block and fst_block.
-        input: None (then it will use node:Node to recurse)
+        Populate recursivly every Nodes with required informations for formating and write them in the
+        preallocated name_block and fst_block. Files are formated after the offsets allocation.
+        input: None (then it will use node:Node and its path to recurse)
         """
         name_offset = 0
         # For root Node we build the nameblock with null trailing byte
         # For others we build the name_block and update the name_offset
         if node is None:
             node = self.__root_node
+            self.__name_offset = 0
         else:
-            name_offset = len(self.__name_block)
-            self.__name_block += node.name().encode("utf-8")+b"\x00"
+            name_offset = self.__name_offset
+            name = node.name().encode("utf-8")
+            self.__name_block[name_offset:name_offset + len(name)] = name
+            self.__name_offset += len(name) + 1
         # We set the name_offset, the id, we increment for next walked node
         node.set_name_offset(name_offset)
         node.set_id(self.__current_id)
         self.__current_id += 1
-        
-        # If it's a directory we have to count childs to set nextdir
+
+        # If it's a directory next dir is the id after all its descendants
         # If it's a file we have to set the offset and add length aligned to it for finding next available offset
         # At the end we add to the fst_block our formated Node
         if node.type() == FstTree.TYPE_DIR:
-            node.set_next_dir(self.__current_id + self.__count_childs(node))
+            node.set_next_dir(self.__current_id + node.descendants_count())
             if node == self.__root_node:
-                self.__fst_block = b"\x01\x00\x00\x00\x00\x00\x00\x00" + node.next_dir().to_bytes(4, "big")
+                self.__fst_block[0:12] = b"\x01\x00\x00\x00\x00\x00\x00\x00" + node.next_dir().to_bytes(4, "big")
             else:
-                self.__fst_block += node.format()
+                self.__fst_block[node.id()*12:node.id()*12+12] = node.format()
             for child in node.childs():
-                self.__prepare(child)
+                self.__prepare(child, f"{path}/{child.name()}" if path else child.name())
         else:
-            node.set_offset(self.__current_file_offset)
-            self.__fst_block += node.format()
-            self.__current_file_offset = align_top(self.__current_file_offset + node.size(), self.__align)
-    def __count_childs(self, node:Folder):
+            self.__files.append( (node, path) )
+    def __allocate_offsets(self):
         """
-        Recursivly count total childs of a Node. It is usefull for getting next_dir id.
-        input: node = Folder
-        return child_count = int
+        Set files offsets one after the other in id order (or in files order if set) from the current file offset
+        or try to keep previous offsets when preserving the layout. Duplicated files get the offset of their source.
         """
-        count = 0
-        for child in node.childs():
-            if child.type() == FstTree.TYPE_DIR:
-                count += self.__count_childs(child)
-        return count + len(node.childs())
+        # duplicated files share the offset of their first copy
+        files = [file for file in self.__files if file[1] not in self.__duplicates]
+        if self.__preserved_offsets is None:
+            if self.__files_order is not None:
+                # sort is stable so files not in the order stay in id order
+                files = sorted(files, key=lambda file: self.__files_order.get(file[1], len(self.__files_order)))
+            for node, path in files:
+                node.set_offset(align_top(self.__current_file_offset, self.__get_align(path)))
+                self.__current_file_offset = align_top(node.offset() + node.size(), self.__align)
+        else:
+            self.__allocate_preserved_offsets(files)
+
+        if self.__duplicates:
+            nodes_dict = {path: node for node, path in self.__files}
+            for path, source_path in self.__duplicates.items():
+                nodes_dict[path].set_offset(nodes_dict[source_path].offset())
+    def __allocate_preserved_offsets(self, files:list):
+        """
+        Files keep their previous offset if they still fit before the next kept file. Only one
+        file is kept by previous offset (files which shared data and aren't duplicated anymore).
+        Others files are put in the smallest free space where they fit (biggest files first) or at the end.
+        input: files = [(File, path), ...]
+        """
+        kept_ranges = []
+        moved_files = []
+        self.__moved_length = 0
+        # previous files sorted by descending offsets (id order for the same offset) to check them against the next kept file
+        preserved_files = []
+        for position, (node, path) in enumerate(files):
+            offset = self.__preserved_offsets.get(path)
+            if offset is not None and offset >= self.__current_file_offset and offset % self.__get_align(path) == 0:
+                preserved_files.append( (position, node, path, offset) )
+            else:
+                if offset is not None:
+                    self.__moved_length += node.size()
+                moved_files.append( (position, node, path) )
+        next_kept_offset = None
+        for position, node, path, offset in sorted(preserved_files, key=lambda file: file[3], reverse=True):
+            if next_kept_offset is None or offset + node.size() <= next_kept_offset:
+                node.set_offset(offset)
+                kept_ranges.append( (offset, align_top(offset + node.size(), self.__align)) )
+                if node.size() > 0:
+                    next_kept_offset = offset
+                continue
+            self.__moved_length += node.size()
+            moved_files.append( (position, node, path) )
+
+        # free spaces: [[begin_offset, end_offset], ...] between kept files
+        free_spaces = []
+        end_offset = self.__current_file_offset
+        for begin_offset, kept_end_offset in sorted(kept_ranges):
+            if begin_offset > end_offset:
+                free_spaces.append( [end_offset, begin_offset] )
+            end_offset = max(end_offset, kept_end_offset)
+
+        # files with the same size stay in id order
+        for _, node, path in sorted(moved_files, key=lambda file: (-file[1].size(), file[0])):
+            align = self.__get_align(path)
+            best_space = None
+            for space in free_spaces:
+                space_len = space[1] - align_top(space[0], align)
+                if space_len >= node.size() and (best_space is None or space_len < best_space[1] - align_top(best_space[0], align)):
+                    best_space = space
+            if best_space is None:
+                node.set_offset(align_top(end_offset, align))
+                end_offset = align_top(node.offset() + node.size(), self.__align)
+            else:
+                node.set_offset(align_top(best_space[0], align))
+                best_space[0] = min(align_top(node.offset() + node.size(), self.__align), best_space[1])
+        self.__current_file_offset = end_offset
+    def __get_align(self, path:str):
+        "return the alignment of the first rule matching the file path or the default align"
+        for pattern, align in self.__align_rules:
+            if fnmatchcase(path, pattern):
+                return align
+        return self.__align
     def add_node_by_path(self, node_path:Path):
         """
         Add a path with each folder as Folder class and the File as a leaf.
@@ -265,30 +675,182 @@ class FstTree(Fst):
         * parent id & parent->child
         input: path = Path (folder / file)
         """
+        self.add_node("/".join(node_path.parts[self.__root_path_length:]), node_path.stat().st_size if node_path.is_file() else None)
+    def add_node(self, node_path:str, size:int = None):
+        """
+        Add a path relative to the root folder with "/" separators without reading the file system.
+        input: node_path = str (folder/file)
+        input: size = int for a File or None for a Folder
+        """
         parent = self.__root_node
-        node = None
-        for i in range(self.__root_path_length, len(node_path.parts)-1):
-            node = Folder(node_path.parts[i], parent)
-            parent = parent.add_child(node)
-        if node_path.is_file():
-            node = File(node_path.name, node_path.stat().st_size)
+        names = node_path.split("/")
+        for name in names[:-1]:
+            parent = parent.add_child(Folder(name, parent))
+        if size is not None:
+            parent.add_child(File(names[-1], size))
         else:
-            node = Folder(node_path.name, parent)
-        parent.add_child(node)
+            parent.add_child(Folder(names[-1], parent))
     def generate_fst(self):
         """
         Generate the FST.
         The hard part Here is that we have to know the result before
         knowing where we can begin to add files.
         """
+        self.__nameblock_length = 0
+        self.__count_descendants(self.__root_node)
+        self.__fst_block = bytearray((self.__root_node.descendants_count() + 1) * 12)
+        self.__name_block = bytearray(self.__nameblock_length)
         if self.__is_fst_last:
             self.__current_file_offset += self.__get_fst_length() # aligned + aligned = aligned
         self.__user_position = self.__current_file_offset
+        self.__files = []
         self.__prepare()
+        self.__allocate_offsets()
+        for node, _ in self.__files:
+            self.__fst_block[node.id()*12:node.id()*12+12] = node.format()
         self.__user_length = self.__current_file_offset - self.__user_position
         return self.__fst_block + self.__name_block
     def user_position(self): return self.__user_position
     def user_length(self):   return self.__user_length
+    def moved_length(self):  return self.__moved_length
+    def set_duplicates(self, duplicates:dict):
+        """
+        Files with the same content use the same offset and size in the FST.
+        input: duplicates = {path: source_path, ... } with source_path the first copy in id order
+        """
+        self.__duplicates = duplicates
+    def set_align_rules(self, align_rules:list):
+        """
+        Use specific alignments for files matching glob patterns, the first matching rule is used.
+        input: align_rules = [(glob_pattern, align), ... ] with patterns matching paths relative to root
+        """
+        self.__align_rules = align_rules
+    def set_files_order(self, paths:list):
+        """
+        Put files data in the GCM/iso using this order instead of the id order. FST ids don't change.
+        input: paths = [path, ... ] relative to root using "/" separators
+        """
+        self.__files_order = {}
+        for path in paths:
+            self.__files_order.setdefault(path, len(self.__files_order))
+    def set_preserved_offsets(self, preserved_offsets:dict):
+        """
+        Keep files at theirs previous offsets when generating the FST if they still fit.
+        input: preserved_offsets = {path: offset, ... } with paths relative to root using "/" separators
+        """
+        self.__preserved_offsets = preserved_offsets
+
+
+class FstIndex(Fst):
+    """
+    FstIndex parse a fst.bin once and give access to all its entries by id.
+    The 12 bytes entries are decoded over a memoryview and stored in compact
+    arrays: type, offset, size, parent id and path. For folders offset is the
+    parent id and size is the next dir id like in the FST. Paths use "/" as
+    separator and are relative to the root folder (root path is "").
+    Names are read until the null byte without copying the name block.
+    Constructor: fstbin_data = bytes
+    """
+    __types = None
+    __offsets = None
+    __sizes = None
+    __parents = None
+    __paths = None
+    # path_dict: {path: id, ... }
+    __path_dict = None
+    # files ids sorted by offsets and theirs offsets for bisect
+    __sorted_files_ids = None
+    __sorted_files_offsets = None
+    # max end offset of files[0:i+1] sorted by offsets
+    __max_end_offsets = None
+    def __init__(self, fstbin_data:bytes):
+        fstbin_data = bytes(fstbin_data)
+        fstbin_view = memoryview(fstbin_data)
+        # root: id=0 so nextdir is the end
+        entries_count = int.from_bytes(fstbin_view[8:12], "big")
+        # offset of filenames block
+        base_names = entries_count * 12
+
+        self.__types   = bytearray(entries_count)
+        self.__offsets = array("I", bytes(entries_count * 4))
+        self.__sizes   = array("I", bytes(entries_count * 4))
+        self.__parents = array("I", bytes(entries_count * 4))
+        self.__paths = [""] * entries_count
+        self.__path_dict = {"": 0}
+        self.__types[0] = FstIndex.TYPE_DIR
+        self.__sizes[0] = entries_count
+
+        # go to parent when id reach next dir
+        dir_ids = [0]
+        nextdir_arr = [entries_count]
+        for id, (type_name_offset, offset, size) in enumerate(struct.iter_unpack(">III", fstbin_view[12:base_names]), start=1):
+            while id == nextdir_arr[-1]:
+                nextdir_arr.pop()
+                dir_ids.pop()
+            name_offset = base_names + (type_name_offset & 0xffffff)
+            name = fstbin_data[name_offset:fstbin_data.find(b"\x00", name_offset)].decode("utf-8")
+
+            self.__types[id] = type_name_offset >> 24
+            self.__offsets[id] = offset
+            self.__sizes[id] = size
+            if self.__types[id] == FstIndex.TYPE_DIR:
+                self.__parents[id] = offset
+                nextdir_arr.append(size)
+                dir_ids.append(id)
+            else:
+                self.__parents[id] = dir_ids[-1]
+            parent_path = self.__paths[self.__parents[id]]
+            self.__paths[id] = f"{parent_path}/{name}" if parent_path else name
+            self.__path_dict[self.__paths[id]] = id
+
+        self.__sorted_files_ids = sorted(self.files_ids(), key=lambda id: self.__offsets[id])
+        self.__sorted_files_offsets = [self.__offsets[id] for id in self.__sorted_files_ids]
+        self.__max_end_offsets = []
+        max_end_offset = 0
+        for id in self.__sorted_files_ids:
+            max_end_offset = max(max_end_offset, self.__offsets[id] + self.__sizes[id])
+            self.__max_end_offsets.append(max_end_offset)
+    def __len__(self):          return len(self.__types)
+    def type(self, id:int):     return self.__types[id]
+    def is_dir(self, id:int):   return self.__types[id] == FstIndex.TYPE_DIR
+    def offset(self, id:int):   return self.__offsets[id]
+    def size(self, id:int):     return self.__sizes[id]
+    def parent(self, id:int):   return self.__parents[id]
+    def next_dir(self, id:int): return self.__sizes[id]
+    def path(self, id:int):     return self.__paths[id]
+    def get_id(self, path:str):
+        "return the id of the entry using its path relative to root or None if not found"
+        return self.__path_dict.get(path)
+    def get_file_id_at(self, offset:int):
+        "return the id of the file containing the offset or None if there is no file at this offset"
+        i = bisect_right(self.__sorted_files_offsets, offset) - 1
+        # search back while a previous file could still contain the offset (overlapping files)
+        while i >= 0 and self.__max_end_offsets[i] > offset:
+            id = self.__sorted_files_ids[i]
+            if offset < self.__offsets[id] + self.__sizes[id]:
+                return id
+            i -= 1
+        return None
+    def childs_ids(self, id:int):
+        "return ids of the folder direct childs in FST order skipping sub folders entries"
+        childs_ids = []
+        child_id = id + 1
+        while child_id < self.__sizes[id]:
+            childs_ids.append(child_id)
+            child_id = self.__sizes[child_id] if self.__types[child_id] == FstIndex.TYPE_DIR else child_id + 1
+        return childs_ids
+    def dirs_ids(self):
+        "return folders ids in FST order without root"
+        return [id for id in range(1, len(self.__types)) if self.__types[id] == FstIndex.TYPE_DIR]
+    def files_ids(self):
+        "return files ids in FST order"
+        return [id for id in range(1, len(self.__types)) if self.__types[id] == FstIndex.TYPE_FILE]
+    def sorted_files_ids(self):
+        "return files ids sorted by offsets"
+        return self.__sorted_files_ids
+    def min_file_offset(self):
+        "return the min file offset or None if there is no file"
+        return self.__sorted_files_offsets[0] if self.__sorted_files_offsets else None
 
 
 class BootBin:
@@ -432,6 +994,184 @@ class Dol:
         return dol_len
 
 
+class Ciso:
+    """
+    CISO compressed GCM/iso format: a 0x8000 bytes header with the "CISO" magic, the block
+    length (u32 little endian) and a map of one byte per block (1 if the block is stored),
+    then only the stored blocks in ascending order. Missing blocks are zeros.
+    """
+    MAGIC = b"CISO"
+    HEADER_LEN = 0x8000
+    MAP_LEN = HEADER_LEN - 8
+    BLOCK_LEN = 0x200000
+
+
+class CisoReader(io.RawIOBase):
+    """
+    CisoReader is a read-only seekable file object over the GCM/iso stored in a CISO file.
+    Offsets are translated through the blocks map and missing blocks are read as zeros.
+    pread is thread safe when os.pread is available.
+    Constructor: ciso_path = Path
+    """
+    __file = None
+    __block_len = None
+    # blocks_offsets: [offset in the CISO file or None, ... ] for each block
+    __blocks_offsets = None
+    __position = 0
+    __len = None
+    def __init__(self, ciso_path:Path):
+        super().__init__()
+        self.name = str(ciso_path)
+        self.__file = ciso_path.open("rb")
+        header = self.__file.read(Ciso.HEADER_LEN)
+        self.__block_len = int.from_bytes(header[4:8], "little")
+        self.__blocks_offsets = []
+        data_offset = Ciso.HEADER_LEN
+        for is_stored in header[8:]:
+            self.__blocks_offsets.append(data_offset if is_stored else None)
+            if is_stored:
+                data_offset += self.__block_len
+        # like Dolphin every block of the map is in the GCM/iso: all-zero blocks at the end aren't stored
+        self.__len = len(self.__blocks_offsets) * self.__block_len
+    def readable(self): return True
+    def seekable(self): return True
+    def block_len(self): return self.__block_len
+    def pread(self, length:int, offset:int):
+        "return up to length bytes of the GCM/iso from offset"
+        data = bytearray()
+        length = max(0, min(length, self.__len - offset))
+        while length > 0:
+            block_id, block_offset = divmod(offset, self.__block_len)
+            read_len = min(length, self.__block_len - block_offset)
+            if self.__blocks_offsets[block_id] is None:
+                data += bytes(read_len)
+            elif hasattr(os, "pread"):
+                data += os.pread(self.__file.fileno(), read_len, self.__blocks_offsets[block_id] + block_offset)
+            else:
+                self.__file.seek(self.__blocks_offsets[block_id] + block_offset)
+                data += self.__file.read(read_len)
+            offset += read_len
+            length -= read_len
+        return bytes(data)
+    def readinto(self, buffer):
+        data = self.pread(len(buffer), self.__position)
+        memoryview(buffer).cast("B")[:len(data)] = data
+        self.__position += len(data)
+        return len(data)
+    def seek(self, offset:int, whence:int = io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.__position
+        elif whence == io.SEEK_END:
+            offset += self.__len
+        self.__position = offset
+        return offset
+    def tell(self): return self.__position
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+        super().close()
+
+
+class CisoWriter(io.RawIOBase):
+    """
+    CisoWriter is a write-only file object writing a GCM/iso in a CISO file.
+    Blocks are kept in memory until a seek goes after them: seeks have to be in ascending
+    offsets order like in Gcm.__write_regions. When the next seek offset is known with
+    set_next_offset, blocks are also written during writes once the position is after them.
+    All-zero blocks aren't stored. The blocks map is written when the file is closed.
+    Constructor: ciso_path = Path, block_len = int
+    """
+    __file = None
+    __block_len = None
+    __map = None
+    # blocks_dict: {block id: bytearray, ... } blocks not written yet
+    __blocks_dict = None
+    __position = 0
+    # blocks before this one are written and can't be changed
+    __first_block_id = 0
+    # next writes are after this offset
+    __next_offset = 0
+    def __init__(self, ciso_path:Path, block_len:int = Ciso.BLOCK_LEN):
+        super().__init__()
+        self.name = str(ciso_path)
+        self.__file = ciso_path.open("wb")
+        self.__block_len = block_len
+        self.__map = bytearray(Ciso.MAP_LEN)
+        self.__blocks_dict = {}
+        self.__file.write(bytes(Ciso.HEADER_LEN))
+    def writable(self): return True
+    def seekable(self): return True
+    def __write_blocks(self, end_block_id:int):
+        "Write or skip all-zero blocks before end_block_id."
+        zero_block = bytes(self.__block_len)
+        for block_id in sorted(self.__blocks_dict):
+            if block_id >= end_block_id:
+                break
+            block = self.__blocks_dict.pop(block_id)
+            if block != zero_block:
+                self.__map[block_id] = 1
+                self.__file.write(block)
+        self.__first_block_id = max(self.__first_block_id, end_block_id)
+    def write(self, data):
+        data = memoryview(data).cast("B")
+        if self.__position // self.__block_len < self.__first_block_id:
+            raise io.UnsupportedOperation(f"Error - CISO blocks before 0x{self.__first_block_id * self.__block_len:x} are already written.")
+        written_len = 0
+        while written_len < len(data):
+            block_id, block_offset = divmod(self.__position, self.__block_len)
+            if block_id >= Ciso.MAP_LEN:
+                raise io.UnsupportedOperation(f"Error - GCM/iso is too long for a CISO with 0x{self.__block_len:x} bytes blocks.")
+            write_len = min(len(data) - written_len, self.__block_len - block_offset)
+            if block_id not in self.__blocks_dict:
+                self.__blocks_dict[block_id] = bytearray(self.__block_len)
+            self.__blocks_dict[block_id][block_offset:block_offset + write_len] = data[written_len:written_len + write_len]
+            written_len += write_len
+            self.__position += write_len
+            if self.__position // self.__block_len > block_id:
+                self.__write_blocks(min(self.__position, self.__next_offset) // self.__block_len)
+        return written_len
+    def set_next_offset(self, offset:int):
+        "Allow to write blocks before offset during writes: next seeks won't go before it."
+        self.__next_offset = offset
+    def seek(self, offset:int, whence:int = io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.__position
+        self.__position = offset
+        self.__write_blocks(offset // self.__block_len)
+        return offset
+    def tell(self): return self.__position
+    def truncate(self, size:int = None):
+        "Blocks are only stored when they contain data: nothing to reserve."
+        return self.__position if size is None else size
+    def close(self):
+        if self.__file is not None and not self.closed:
+            self.__write_blocks(Ciso.MAP_LEN)
+            self.__file.seek(0)
+            self.__file.write(Ciso.MAGIC + self.__block_len.to_bytes(4, "little") + self.__map)
+            self.__file.close()
+        super().close()
+
+
+def is_ciso(iso_path:Path):
+    "return True if iso_path is a CISO file"
+    with iso_path.open("rb") as iso_file:
+        return iso_file.read(4) == Ciso.MAGIC
+
+
+def open_gcm(iso_path:Path):
+    "return a file object reading the GCM/iso of a GCM/iso file or of a CISO file"
+    if is_ciso(iso_path):
+        return CisoReader(iso_path)
+    return iso_path.open("rb")
+
+
+def create_gcm(iso_path:Path):
+    "return a file object writing a new GCM/iso: a CisoWriter when iso_path has the .ciso extension"
+    if iso_path.suffix.lower() == ".ciso":
+        return CisoWriter(iso_path)
+    return iso_path.open("wb")
+
+
 class Gcm:
     """
     Gcm handle all operations needed by the command parser.
@@ -441,6 +1181,17 @@ class Gcm:
     APPLOADER_OFFSET = 0x2440
     APPLOADERLEN_OFFSET = 0x2454
     DVD_MAGIC = b"\xC2\x33\x9F\x3D"
+    # Length of blocks used when copying files from or to the GCM/iso
+    COPY_BLOCK_LEN = 0x100000
+    # Max distance between the lowest current read offset and a new read started by unpack --jobs
+    UNPACK_READ_WINDOW_LEN = 0x4000000
+    # Count of empty spaces printed by stats in the largest empty spaces table
+    LARGEST_EMPTY_SPACES_COUNT = 10
+    # Length of all-zero blocks skipped with seeks by --sparse
+    SPARSE_BLOCK_LEN = 0x10000
+    SPARSE_ZERO_BLOCK = bytes(SPARSE_BLOCK_LEN)
+    # Length of blocks matched by --diff: a modification costs at most 2 blocks of inserted data
+    DELTA_BLOCK_LEN = 0x100
     __bootbin = None # Disc header
     __bi2bin = None  # Disc header Information
     __apploaderimg = None
@@ -491,9 +1242,31 @@ class Gcm:
         config.set("apploader.img", "Size",        f"0x{self.__apploaderimg.size():x}")
         config.set("apploader.img", "TrailerSize", f"0x{self.__apploaderimg.trailer_size():x}")
 
+        config.add_section("alignments")
+        config.set("alignments", "# glob_pattern = 0xabcdef alignment used by --rebuild-fst for matching root files, first match is used. Others files use -a.")
+        config.set("alignments", "# *.adp = 0x8000")
+
         with (sys_path / "system.conf").open("w") as conf_file:
             config.write(conf_file)
         logging.info("sys/sytem.conf saved.")
+    def __load_align_rules(self, sys_path:Path):
+        """
+        Load the [alignments] section of sys/system.conf if there is one.
+        return align_rules = [(glob_pattern, align), ... ]
+        """
+        config = ConfigParser(allow_no_value=True) # allow_no_value to allow comments
+        config.optionxform = str # makes options case sensitive
+        config.read(sys_path / "system.conf")
+        if not config.has_section("alignments"):
+            return []
+        align_rules = []
+        for pattern, align in config["alignments"].items():
+            if align is None: # comment
+                continue
+            if not self.__hex_pattern.fullmatch(align) or int(align, 16) == 0:
+                raise InvalidConfValueError(f"Error - Invalid [alignments][{pattern}]: must be hex > 0 - 0xabcdef.")
+            align_rules.append( (pattern, int(align, 16)) )
+        return align_rules
     def __load_conf(self, sys_path:Path, get_conf_values:bool = False):
         "Patch boot.bin, bi2.bin and apploader.img with the conf in sys/system.conf if Default section status is enabled."
         config = ConfigParser(allow_no_value=True) # allow_no_value to allow adding comments
@@ -716,23 +1489,62 @@ class Gcm:
                 conf_value_user_position,
                 conf_value_user_length
             )
-    def __get_min_file_offset(self, fstbin_data:bytes):
-        "Get the min file offset to check if there is an overflow."
-        min_offset = None
-        for i in range(2, int.from_bytes(fstbin_data[8:12], "big")):
-            if int.from_bytes(fstbin_data[i*12:i*12+1], "big") == FstTree.TYPE_FILE:
-                if min_offset is None:
-                    min_offset = int.from_bytes(fstbin_data[i*12+4:i*12+8], "big")
-                    continue
-                min_offset = min(min_offset, int.from_bytes(fstbin_data[i*12+4:i*12+8], "big"))
-        return min_offset
-    def unpack(self, iso_path:Path, folder_path:Path):
+    def __extract_file(self, iso_file, offset:int, length:int, file_path:Path, buffer:memoryview):
+        """
+        Copy length bytes of the GCM/iso from offset in a new file by blocks using the reusable buffer.
+        The crc32 is computed while the data is in the buffer.
+        input: iso_file = file opened in rb mode
+        input: offset = int
+        input: length = int
+        input: file_path = Path
+        input: buffer = memoryview
+        return crc32 = int
+        """
+        crc32 = 0
+        iso_file.seek(offset)
+        with file_path.open("wb") as file:
+            while length > 0:
+                read_len = iso_file.readinto(buffer[:min(length, len(buffer))])
+                if not read_len: # GCM/iso is shorter than expected
+                    break
+                file.write(buffer[:read_len])
+                crc32 = zlib.crc32(buffer[:read_len], crc32)
+                length -= read_len
+        return crc32
+    def __extract_file_pread(self, pread, offset:int, length:int, file_path:Path, on_read = None):
+        """
+        Thread safe version of __extract_file: positional reads don't use the shared file position.
+        input: pread = function(length, offset) returning bytes
+        input: offset = int
+        input: length = int
+        input: file_path = Path
+        input: on_read = function(offset) called with the next read offset after each read or None
+        return crc32 = int
+        """
+        crc32 = 0
+        with file_path.open("wb") as file:
+            while length > 0:
+                data = pread(min(length, Gcm.COPY_BLOCK_LEN), offset)
+                if not data: # GCM/iso is shorter than expected
+                    break
+                file.write(data)
+                crc32 = zlib.crc32(data, crc32)
+                offset += len(data)
+                length -= len(data)
+                if on_read is not None:
+                    on_read(offset)
+        return crc32
+    def unpack(self, iso_path:Path, folder_path:Path, jobs:int = 1):
         """
         Unpack takes an GCM/iso file and unpack it in a folder.
         input: iso_path = Path
         input: folder_path = Path
+        input: jobs = int (threads count used to extract files)
         """
-        with iso_path.open("rb") as iso_file:
+        if jobs > 1 and not hasattr(os, "pread"):
+            logging.warning("os.pread is not available on this platform: using --jobs 1.")
+            jobs = 1
+        with open_gcm(iso_path) as iso_file:
             self.__bootbin = BootBin(iso_file.read(BootBin.LEN))
             if self.__bootbin.dvd_magic() != Gcm.DVD_MAGIC:
                 raise InvalidDVDMagicError("Error - Invalid DVD format - this tool is for ISO/GCM files.")
@@ -769,16 +1581,23 @@ class Gcm:
             sys_path = folder_path / "sys"
             sys_path.mkdir(parents=True)
 
+            manifest = Manifest(folder_path)
+
             logging.debug(f"{iso_path}(0x0:0x{BootBin.LEN:x}) -> {sys_path / 'boot.bin'}")
             (sys_path / "boot.bin").write_bytes(self.__bootbin.data())
+            manifest.add("sys/boot.bin", 0, self.__bootbin.data())
             logging.debug(f"{iso_path}(0x440:0x{Gcm.APPLOADER_OFFSET:x}) -> {sys_path / 'bi2.bin'}")
             (sys_path / "bi2.bin" ).write_bytes(self.__bi2bin.data())
+            manifest.add("sys/bi2.bin", BootBin.LEN, self.__bi2bin.data())
             logging.debug(f"{iso_path}(0x{Gcm.APPLOADER_OFFSET:x}:0x{Gcm.APPLOADER_OFFSET + apploader_size:x} -> {sys_path / 'apploader.img'}")
             (sys_path / "apploader.img").write_bytes(self.__apploaderimg.data())
+            manifest.add("sys/apploader.img", Gcm.APPLOADER_OFFSET, self.__apploaderimg.data())
             logging.debug(f"{iso_path}(0x{fstbin_offset:x}:0x{fstbin_offset + fstbin_len:x}) -> {sys_path / 'fst.bin'}")
             (sys_path / "fst.bin").write_bytes(fstbin_data)
+            manifest.add("sys/fst.bin", fstbin_offset, fstbin_data)
             logging.debug(f"{iso_path}(0x{dol_offset:x}:0x{dol_offset + dol_len:x}) -> {sys_path / 'boot.dol'}")
             (sys_path / "boot.dol").write_bytes(bootdol_data)
+            manifest.add("sys/boot.dol", dol_offset, bootdol_data)
 
             # Generate conf from sys files
             self.__save_conf(sys_path)
@@ -786,47 +1605,197 @@ class Gcm:
             root_path = folder_path / "root"
             root_path.mkdir()
             
-            # And now we parse FST data to unpack all files in the GCM iso file
-            dir_id_path = {0: root_path}
-            currentdir_path = root_path
-
-            # root: id=0 so nextdir is the end
-            nextdir = int.from_bytes(fstbin_data[8:12], "big")
-            # offset of filenames block
-            base_names = nextdir * 12
-            # go to parent when id reach next dir
-            nextdir_arr = [ nextdir ]
-
-            for id in range(1, base_names // 12):
-                i = id * 12
-                file_type = int.from_bytes(fstbin_data[i:i+1], "big")
-                name = fstbin_data[base_names + int.from_bytes(fstbin_data[i+1:i+4], "big"):].split(b"\x00")[0].decode("utf-8")
-                
-                while id == nextdir_arr[-1]:
-                    currentdir_path = currentdir_path.parent
-                    nextdir_arr.pop()
-
-                if file_type == FstTree.TYPE_DIR:
-                    nextdir = int.from_bytes(fstbin_data[i+8:i+12], "big")
-                    parentdir = int.from_bytes(fstbin_data[i+4:i+8], "big")
-
-                    nextdir_arr.append( nextdir )
-                    currentdir_path = dir_id_path[parentdir] / name
-                    dir_id_path[id] = currentdir_path
-                    currentdir_path.mkdir(exist_ok=True)
+            # And now we use the FST to unpack all files in the GCM iso file
+            # Dirs are created first so files can be extracted in ascending offsets order for sequential reads
+            fst_index = FstIndex(fstbin_data)
+            for id in fst_index.dirs_ids():
+                (root_path / fst_index.path(id)).mkdir(exist_ok=True)
+
+            if jobs > 1:
+                # Files are started in ascending offsets order with at most jobs reads in flight.
+                # A file is started only if its offset is in the read window of the lowest current
+                # read offset: reads stay close to each other on the disc while large files progress.
+                pread = iso_file.pread if isinstance(iso_file, CisoReader) else lambda length, offset: os.pread(iso_file.fileno(), length, offset)
+                sorted_files_ids = fst_index.sorted_files_ids()
+                # read_offsets: {id: current read offset, ...} of files being extracted
+                read_offsets = {}
+                read_condition = threading.Condition()
+                read_failed = False
+                def set_read_offset(id:int, offset:int):
+                    with read_condition:
+                        read_offsets[id] = offset
+                        read_condition.notify()
+                def extract_file(id:int):
+                    nonlocal read_failed
+                    try:
+                        return self.__extract_file_pread(pread, fst_index.offset(id), fst_index.size(id), root_path / fst_index.path(id), \
+                            lambda offset: set_read_offset(id, offset))
+                    except Exception:
+                        read_failed = True
+                        raise
+                    finally:
+                        with read_condition:
+                            del read_offsets[id]
+                            read_condition.notify()
+                futures = []
+                with ThreadPoolExecutor(max_workers=jobs) as executor:
+                    with read_condition:
+                        for id in sorted_files_ids:
+                            read_condition.wait_for(lambda: read_failed or len(read_offsets) < jobs and (not read_offsets or \
+                                fst_index.offset(id) - min(read_offsets.values()) <= Gcm.UNPACK_READ_WINDOW_LEN))
+                            if read_failed:
+                                break
+                            read_offsets[id] = fst_index.offset(id)
+                            futures.append(executor.submit(extract_file, id))
+                for id, future in zip(sorted_files_ids, futures):
+                    manifest.add_crc32(f"root/{fst_index.path(id)}", fst_index.offset(id), fst_index.size(id), future.result())
+                    logging.debug(f"{iso_path}(0x{fst_index.offset(id):x}:0x{fst_index.offset(id) + fst_index.size(id):x}) -> {root_path / fst_index.path(id)}")
+            else:
+                buffer = memoryview(bytearray(Gcm.COPY_BLOCK_LEN))
+                for id in fst_index.sorted_files_ids():
+                    entry_path = root_path / fst_index.path(id)
+                    fileoffset = fst_index.offset(id)
+                    filesize   = fst_index.size(id)
+
+                    crc32 = self.__extract_file(iso_file, fileoffset, filesize, entry_path, buffer)
+                    manifest.add_crc32(f"root/{fst_index.path(id)}", fileoffset, filesize, crc32)
+
+                    logging.debug(f"{iso_path}(0x{fileoffset:x}:0x{fileoffset + filesize:x}) -> {entry_path}")
+            manifest.save()
+    def __check_root_folder(self, fst_index:FstIndex, root_path:Path):
+        """
+        Validate every FST entries against one snapshot of the root folder and report all errors at once.
+        The raised exception is the most important error found: removed or renamed dirs, then files,
+        then files lengths and then files or dirs added in the root folder.
+        input: fst_index = FstIndex
+        input: root_path = Path
+        """
+        root_snapshot = FolderSnapshot(root_path)
+        errors = {FSTDirNotFoundError: [], FSTFileNotFoundError: [], InvalidFSTFileSizeError: [], InvalidRootFileFolderCountError: []}
+        missing_dirs = set()
+        for id in range(1, len(fst_index)):
+            entry_path = fst_index.path(id)
+            # entries of missing dirs are not reported
+            if fst_index.parent(id) in missing_dirs:
+                if fst_index.is_dir(id):
+                    missing_dirs.add(id)
+                continue
+            entry = root_snapshot.get(entry_path)
+            if fst_index.is_dir(id):
+                if entry is None or entry[0] != FstIndex.TYPE_DIR:
+                    missing_dirs.add(id)
+                    errors[FSTDirNotFoundError].append(f"FST dir {root_path / entry_path} not found in the root directory: the dir has been removed or renamed.")
+            elif entry is None or entry[0] != FstIndex.TYPE_FILE:
+                errors[FSTFileNotFoundError].append(f"FST file {root_path / entry_path} not found in the root directory: the file has been removed or renamed.")
+            elif entry[1] != fst_index.size(id):
+                errors[InvalidFSTFileSizeError].append(f"Invalid file length: {root_path / entry_path} (0x{entry[1]:x} instead of 0x{fst_index.size(id):x} in the FST).")
+        for entry_path in root_snapshot.paths():
+            # children of added dirs are not reported
+            if fst_index.get_id(entry_path) is None and fst_index.get_id(entry_path.rpartition("/")[0]) is not None:
+                errors[InvalidRootFileFolderCountError].append(f"{root_path / entry_path} not found in the FST: it has been added.")
+
+        errors_list = [message for messages in errors.values() for message in messages]
+        for exception_type, messages in errors.items():
+            if messages:
+                raise exception_type(f"Error - Invalid root folder {root_path} ({len(errors_list)} errors):\n* " + "\n* ".join(errors_list) + \
+                    "\nUse --rebuild-fst to update the FST and avoid this error. Warning: DVD SDK use dirnames and filenames to load files from the GCM/iso.")
+    def __copy_range(self, src_file, iso_file, offset:int, length:int, buffer:memoryview):
+        """
+        Copy length bytes of src_file from offset at the current position of iso_file.
+        Use os.copy_file_range when available so data isn't copied in user space
+        and fallback on block copies using the reusable buffer.
+        """
+        if hasattr(os, "copy_file_range") and not isinstance(src_file, CisoReader) and not isinstance(iso_file, CisoWriter):
+            iso_file.flush()
+            dst_offset = iso_file.tell()
+            try:
+                while length > 0:
+                    copied_len = os.copy_file_range(src_file.fileno(), iso_file.fileno(), length, offset, dst_offset)
+                    if copied_len == 0: # src_file is shorter than expected
+                        break
+                    offset += copied_len
+                    dst_offset += copied_len
+                    length -= copied_len
+            except OSError: # Not supported between those file systems
+                pass
+            iso_file.seek(dst_offset)
+        src_file.seek(offset)
+        while length > 0:
+            read_len = src_file.readinto(buffer[:min(length, len(buffer))])
+            if not read_len:
+                break
+            iso_file.write(buffer[:read_len])
+            length -= read_len
+    def __write_sparse(self, iso_file, data:memoryview):
+        "Write data at the current position of iso_file seeking over all-zero blocks so they stay holes."
+        for block_offset in range(0, len(data), Gcm.SPARSE_BLOCK_LEN):
+            block = data[block_offset:block_offset + Gcm.SPARSE_BLOCK_LEN]
+            if block.tobytes() == Gcm.SPARSE_ZERO_BLOCK[:len(block)]:
+                iso_file.seek(len(block), os.SEEK_CUR)
+            else:
+                iso_file.write(block)
+    def __copy_file(self, file_path:Path, iso_file, buffer:memoryview, sparse:bool = False):
+        """
+        Copy file_path at the current position of iso_file by blocks using the reusable buffer.
+        When sparse is True all-zero blocks are skipped with seeks.
+        return the number of bytes copied
+        """
+        copied_len = 0
+        with file_path.open("rb") as file:
+            read_len = file.readinto(buffer)
+            while read_len:
+                if sparse:
+                    self.__write_sparse(iso_file, buffer[:read_len])
                 else:
-                    fileoffset = int.from_bytes(fstbin_data[i+4:i+8], "big")
-                    filesize   = int.from_bytes(fstbin_data[i+8:i+12], "big")
-
-                    iso_file.seek(fileoffset)
-                    (currentdir_path / name).write_bytes( iso_file.read(filesize) )
-
-                    logging.debug(f"{iso_path}(0x{fileoffset:x}:0x{fileoffset + filesize:x}) -> {currentdir_path / name}")
-    def pack(self, folder_path:Path, iso_path:Path = None, disable_ignore:bool = False, skip_conf:bool = False):
+                    iso_file.write(buffer[:read_len])
+                copied_len += read_len
+                read_len = file.readinto(buffer)
+        return copied_len
+    def __write_regions(self, iso_file, regions:list, sparse:bool = False, src_file = None):
+        """
+        Write all regions of the GCM/iso in one forward pass sorted by offsets.
+        The final size is reserved first: with posix_fallocate when available to avoid a fragmented
+        image or with truncate only when sparse is True so gaps between regions stay holes.
+        When sparse is True all-zero blocks of files and system files are also skipped with seeks
+        except in regions overlapping previous ones.
+        input: iso_file = file opened in wb mode
+        input: regions = [(offset:int, length:int, source:bytes or Path or int, name:str), ...]
+            an int source is an offset in src_file
+        input: sparse = bool
+        input: src_file = file opened in rb mode
+        """
+        regions = sorted(regions, key=lambda region: region[0])
+        iso_len = max(offset + length for offset, length, _, _ in regions)
+        if not sparse and hasattr(os, "posix_fallocate") and not isinstance(iso_file, CisoWriter):
+            os.posix_fallocate(iso_file.fileno(), 0, iso_len)
+        else:
+            iso_file.truncate(iso_len)
+
+        buffer = memoryview(bytearray(Gcm.COPY_BLOCK_LEN))
+        written_end_offset = 0
+        for i, (offset, length, source, name) in enumerate(regions):
+            logging.debug(f"{name} -> {iso_file.name}(0x{offset:x}:0x{offset + length:x})")
+            iso_file.seek(offset)
+            if isinstance(iso_file, CisoWriter):
+                # blocks before the next region are complete: overlapping regions keep theirs blocks in memory
+                iso_file.set_next_offset(regions[i + 1][0] if i + 1 < len(regions) else iso_len)
+            # holes would keep data of overlapped regions
+            sparse_region = sparse and offset >= written_end_offset
+            if isinstance(source, Path):
+                self.__copy_file(source, iso_file, buffer, sparse_region)
+            elif isinstance(source, int):
+                self.__copy_range(src_file, iso_file, source, length, buffer)
+            elif sparse_region:
+                self.__write_sparse(iso_file, memoryview(source))
+            else:
+                iso_file.write(source)
+            written_end_offset = max(written_end_offset, offset + length)
+    def pack(self, folder_path:Path, iso_path:Path = None, disable_ignore:bool = False, skip_conf:bool = False, sparse:bool = False):
         """
         Pack takes a folder unpacked by the pack command and pack it in a GCM/iso file.
         input: folder_path = Path
         input: iso_path = Path
+        input: sparse = bool (keep empty spaces between files as sparse holes)
         """
         if iso_path is None:
             iso_path = folder_path.parent / Path(folder_path.name).with_suffix(".iso")
@@ -834,7 +1803,7 @@ class Gcm:
             raise InvalidPackIsoError(f"Error - {iso_path} already exist. Remove this file or use another GCM file name.")
 
         try:
-            with iso_path.open("wb") as iso_file:
+            with create_gcm(iso_path) as iso_file:
                 sys_path = folder_path / "sys"
                 
                 self.__bootbin = BootBin((sys_path / "boot.bin").read_bytes())
@@ -847,29 +1816,27 @@ class Gcm:
                 if self.__bootbin.fst_len() > self.__bootbin.fst_max_len():
                     raise InvalidFSTSizeError(f"Error - fst.bin max length < fst.bin length in boot.bin offset 0x{BootBin.FSTMAXLEN_OFFSET:x}:0x{BootBin.FSTMAXLEN_OFFSET+4:x}.")
 
-                logging.debug(f"{sys_path / 'boot.bin'}      -> {iso_path}(0x0:0x{BootBin.LEN:x})")
-                iso_file.write(self.__bootbin.data())
-                logging.debug(f"{sys_path / 'bi2.bin'}       -> {iso_path}(0x{BootBin.LEN:x}:0x{Gcm.APPLOADER_OFFSET:x})")
-                iso_file.write(self.__bi2bin.data())
+                # regions: [(offset, length, bytes or Path, name), ...] written at the end sorted by offsets
+                regions = [
+                    (0, BootBin.LEN, self.__bootbin.data(), sys_path / "boot.bin"),
+                    (BootBin.LEN, Bi2Bin.LEN, self.__bi2bin.data(), sys_path / "bi2.bin"),
+                    (Gcm.APPLOADER_OFFSET, self.__apploaderimg.len(), self.__apploaderimg.data(), sys_path / "apploader.img")]
 
                 apploader_end_offset = Gcm.APPLOADER_OFFSET + self.__apploaderimg.len()
-                logging.debug(f"{sys_path / 'apploader.img'} -> {iso_path}(0x{Gcm.APPLOADER_OFFSET:x}:0x{apploader_end_offset:x}")
-                iso_file.write(self.__apploaderimg.data())
 
                 fstbin_offset = self.__bootbin.fst_offset()
                 fstbin_len = self.__bootbin.fst_len()
                 fstbin_end_offset = fstbin_offset + fstbin_len
                 if (sys_path / "fst.bin").stat().st_size != fstbin_len:
                     raise InvalidFSTSizeError(f"Error - Invalid fst.bin length in boot.bin offset 0x{BootBin.FSTLEN_OFFSET:x}:0x{BootBin.FSTLEN_OFFSET+4:x}.")
-                logging.debug(f"{sys_path / 'fst.bin'}       -> {iso_path}(0x{fstbin_offset:x}:0x{fstbin_offset + fstbin_len:x})")
-                iso_file.seek( fstbin_offset )
                 fstbin_data = (sys_path / "fst.bin").read_bytes()
-                iso_file.write( fstbin_data )
+                regions.append( (fstbin_offset, fstbin_len, fstbin_data, sys_path / "fst.bin") )
                 
                 dol_offset = self.__bootbin.dol_offset()
                 dol_end_offset = dol_offset + (sys_path / 'boot.dol').stat().st_size
 
-                min_file_offset = self.__get_min_file_offset(fstbin_data)
+                fst_index = FstIndex(fstbin_data)
+                min_file_offset = fst_index.min_file_offset()
 
                 # FST can be before the dol or after
                 # We control values to avoid Overflows
@@ -886,64 +1853,79 @@ class Gcm:
                     Gcm.APPLOADER_OFFSET < fstbin_offset < apploader_end_offset:
                     raise ApploaderOverflowError("Error - The apploader length has been increased and overflow on dol or on FST. To solve this check the sys/system.conf file if used or use --rebuild-fst.")
 
-                logging.debug(f"{sys_path / 'boot.dol'}      -> {iso_path}(0x{dol_offset:x}:0x{dol_end_offset:x})")
-                iso_file.seek( dol_offset )
-                iso_file.write( (sys_path / "boot.dol").read_bytes() )
-
-                # Now parse fst.bin for writing files in the iso
-                dir_id_path = {0: folder_path / "root"}
-                currentdir_path = folder_path / "root"
-
-                # root: id=0 so nextdir is the end
-                nextdir = int.from_bytes(fstbin_data[8:12], "big")
-                # offset of filenames block
-                base_names = nextdir * 12
-                # go to parent when id reach next dir
-                nextdir_arr = [ nextdir ]
-
-                # Check if there is new / removed files or dirs in the root folder
-                if nextdir - 1 != len(list(currentdir_path.glob("**/*"))):
-                    raise InvalidRootFileFolderCountError(f"Error - Invalid file & folders count inside {currentdir_path}. Use --rebuild-fst to update the FST before packing.")
-
-                for id in range(1, base_names // 12):
-                    i = id * 12
-                    file_type = int.from_bytes(fstbin_data[i:i+1], "big")
-                    name = fstbin_data[base_names + int.from_bytes(fstbin_data[i+1:i+4], "big"):].split(b"\x00")[0].decode("utf-8")
-                    
-                    while id == nextdir_arr[-1]:
-                        currentdir_path = currentdir_path.parent
-                        nextdir_arr.pop()
-
-                    if file_type == FstTree.TYPE_DIR:
-                        nextdir = int.from_bytes(fstbin_data[i+8:i+12], "big")
-                        parentdir = int.from_bytes(fstbin_data[i+4:i+8], "big")
-
-                        nextdir_arr.append( nextdir )
-                        currentdir_path = dir_id_path[parentdir] / name
-                        dir_id_path[id] = currentdir_path
-                        if not currentdir_path.is_dir():
-                            raise FSTDirNotFoundError(f"Error - FST dir {currentdir_path} not found in the root directory. "
-                                "The dir has been removed or renamed. Use --rebuild-fst to update the FST and avoid this error."
-                                "Warning: DVD SDK use dirnames to load files from the GCM/iso.")
-                    else:
-                        if not (currentdir_path / name).is_file():
-                            raise FSTFileNotFoundError(f"Error - FST file {currentdir_path / name} not found in the root directory. "
-                                "The file has been removed or renamed. Use --rebuild-fst to update the FST and avoid this error."
-                                "Warning: DVD SDK use filenames to load files from the GCM/iso.")
-                        
-                        file_offset = int.from_bytes(fstbin_data[i+4:i+8], "big")
-                        file_len   = int.from_bytes(fstbin_data[i+8:i+12], "big")
-
-                        if (currentdir_path / name).stat().st_size != file_len:
-                            raise InvalidFSTFileSizeError(f"Error - Invalid file length: {currentdir_path / name} - use --rebuild-fst before packing files in the iso.")
-                        logging.debug(f"{currentdir_path / name} -> {iso_path}(0x{file_offset:x}:0x{file_offset + file_len:x})")
-                        iso_file.seek(file_offset)
-                        iso_file.write( (currentdir_path / name).read_bytes() )
+                regions.append( (dol_offset, dol_end_offset - dol_offset, sys_path / "boot.dol", sys_path / "boot.dol") )
+
+                # Now use the FST for writing files in the iso
+                root_path = folder_path / "root"
+
+                # Check the whole FST against the root folder before writing files
+                self.__check_root_folder(fst_index, root_path)
+
+                # Files sharing the same data (--dedupe) are written once
+                extents = set()
+                for id in fst_index.files_ids():
+                    if (fst_index.offset(id), fst_index.size(id)) in extents:
+                        continue
+                    extents.add( (fst_index.offset(id), fst_index.size(id)) )
+                    regions.append( (fst_index.offset(id), fst_index.size(id), root_path / fst_index.path(id), root_path / fst_index.path(id)) )
+
+                self.__write_regions(iso_file, regions, sparse)
         except (InvalidFSTSizeError, DolSizeOverflowError, InvalidRootFileFolderCountError, InvalidFSTFileSizeError, \
             FSTDirNotFoundError, FSTFileNotFoundError, InvalidConfValueError, FstSizeOverflowError, ApploaderOverflowError):
             iso_path.unlink()
             raise
-    def rebuild_fst(self, folder_path:Path, align:int, skip_conf:bool):
+    def __load_trace(self, trace_path:Path, root_path:Path):
+        """
+        Load a files access trace: one FST path per line in reading order like logged by emulators.
+        "/" prefix and "\\" separators are accepted. Unknown paths are ignored.
+        input: trace_path = Path
+        input: root_path = Path
+        return [path, ... ] relative to root using "/" separators
+        """
+        paths = []
+        unknown_count = 0
+        for line in trace_path.read_text().split("\n"):
+            path = line.strip().replace("\\", "/").lstrip("/")
+            if path == "":
+                continue
+            path = Path(path).as_posix()
+            if not (root_path / path).is_file():
+                unknown_count += 1
+                continue
+            paths.append(path)
+        if unknown_count > 0:
+            logging.warning(f"{unknown_count} paths of \"{trace_path}\" not found in {root_path} are ignored.")
+        return paths
+    def __get_duplicates(self, root_path:Path, paths:list):
+        """
+        Find root files with the same content. Only files with the same size are hashed.
+        input: root_path = Path
+        input: paths = [Path, ...] of files and folders in FST order
+        return duplicates = {path: source_path, ... } with paths relative to root using "/" separators
+        """
+        # sizes_dict: {size: [path, ... ], ... }
+        sizes_dict = {}
+        for path in paths:
+            if path.is_file() and path.stat().st_size > 0:
+                sizes_dict.setdefault(path.stat().st_size, []).append(path.relative_to(root_path).as_posix())
+        duplicates = {}
+        duplicated_length = 0
+        for size, same_size_paths in sizes_dict.items():
+            if len(same_size_paths) < 2:
+                continue
+            # sources_dict: {sha1: source_path, ... }
+            sources_dict = {}
+            for path in same_size_paths:
+                sha1 = get_file_sha1(root_path / path)
+                if sha1 in sources_dict:
+                    duplicates[path] = sources_dict[sha1]
+                    duplicated_length += size
+                    logging.debug(f"{path} is a duplicate of {sources_dict[sha1]}")
+                else:
+                    sources_dict[sha1] = path
+        logging.info(f"Dedupe: {len(duplicates)} duplicated files sharing data (0x{duplicated_length:x} bytes saved).")
+        return duplicates
+    def rebuild_fst(self, folder_path:Path, align:int, skip_conf:bool, preserve_layout:bool = False, trace_path:Path = None, dedupe:bool = False):
         """
         Rebuild FST generate a new file system by using all files in the root folder
         it patch boot.bin caracteristics, apploader.img and also file system changes.
@@ -951,6 +1933,9 @@ class Gcm:
         root filesystem. Align is 0x8000 for APDCM.
         input: folder_path = Path
         input: align = int
+        input: preserve_layout = bool (keep files at their sys/fst.bin offsets when they still fit)
+        input: trace_path = Path of a text file with FST paths in reading order used for the data layout
+        input: dedupe = bool (files with the same content share the same data in the GCM/iso)
         """
         root_path = folder_path / "root"
         sys_path = folder_path / "sys"
@@ -991,10 +1976,21 @@ class Gcm:
             fst_tree.add_node_by_path(path)
         logging.debug(fst_tree)
 
+        fst_tree.set_align_rules(self.__load_align_rules(sys_path))
+        if dedupe:
+            fst_tree.set_duplicates(self.__get_duplicates(root_path, path_list))
+        if trace_path is not None:
+            fst_tree.set_files_order(self.__load_trace(trace_path, root_path))
+
         fst_path = sys_path / "fst.bin"
+        if preserve_layout and fst_path.is_file():
+            previous_fst_index = FstIndex(fst_path.read_bytes())
+            fst_tree.set_preserved_offsets({previous_fst_index.path(id): previous_fst_index.offset(id) for id in previous_fst_index.files_ids()})
 
         logging.info(f"Writing fst in sys/fst.bin")
         fst_path.write_bytes( fst_tree.generate_fst() )
+        if fst_tree.moved_length() is not None:
+            logging.info(f"Preserve layout: 0x{fst_tree.moved_length():x} bytes of files moved.")
 
         if fst_len == 0:
             fst_len = fst_path.stat().st_size
@@ -1017,6 +2013,453 @@ class Gcm:
             self.__bootbin.set_user_length(user_length)
 
         (sys_path / "boot.bin").write_bytes(self.__bootbin.data())
+    def overlay(self, iso_path:Path, changes_path:Path, new_iso_path:Path, align:int = 4, sparse:bool = False):
+        """
+        Build a new GCM/iso using the original GCM/iso and a folder containing only changed files.
+        Files of changes_path/root replace or add FST entries and other files and system files are
+        copied range by range from the original GCM/iso. The FST and boot.bin are rebuilt like with
+        --rebuild-fst: dol after apploader, FST after dol and files sorted by paths after the FST.
+        input: iso_path = Path
+        input: changes_path = Path
+        input: new_iso_path = Path
+        input: align = int
+        input: sparse = bool
+        """
+        if new_iso_path.is_file():
+            raise InvalidPackIsoError(f"Error - {new_iso_path} already exist. Remove this file or use another GCM file name.")
+        changes_root_path = changes_path / "root"
+        changes_snapshot = FolderSnapshot(changes_root_path) if changes_root_path.is_dir() else None
+
+        with open_gcm(iso_path) as iso_file:
+            self.__bootbin = BootBin(iso_file.read(BootBin.LEN))
+            if self.__bootbin.dvd_magic() != Gcm.DVD_MAGIC:
+                raise InvalidDVDMagicError("Error - Invalid DVD format - this tool is for ISO/GCM files.")
+            self.__bootbin.make_mut()
+            self.__bi2bin = Bi2Bin(iso_file.read(Bi2Bin.LEN))
+            iso_file.seek(Gcm.APPLOADERLEN_OFFSET)
+            apploader_len = Gcm.APPLOADER_HEADER_LEN + int.from_bytes(iso_file.read(4), "big") + int.from_bytes(iso_file.read(4), "big")
+            original_dol_offset = self.__bootbin.dol_offset()
+            iso_file.seek(original_dol_offset)
+            dol_len = Dol().get_dol_len(iso_file.read(Dol.HEADER_LEN))
+            iso_file.seek(self.__bootbin.fst_offset())
+            fst_index = FstIndex(iso_file.read(self.__bootbin.fst_len()))
+
+            # sources: {path: offset in the original GCM/iso or Path of the changed file, ... }
+            # sizes:   {path: file size or None for folders, ... }
+            sources = {}
+            sizes = {}
+            for id in range(1, len(fst_index)):
+                sizes[fst_index.path(id)] = None if fst_index.is_dir(id) else fst_index.size(id)
+                sources[fst_index.path(id)] = fst_index.offset(id)
+            if changes_snapshot is not None:
+                for path in changes_snapshot.paths():
+                    (entry_type, size) = changes_snapshot.get(path)
+                    if path in sizes and (sizes[path] is None) != (entry_type == Fst.TYPE_DIR):
+                        raise InvalidOverlayPathError(f"Error - {changes_root_path / path} type is different in the FST of \"{iso_path}\".")
+                    if entry_type == Fst.TYPE_FILE:
+                        logging.info(f"{'Replacing' if path in sizes else 'Adding'} {path}")
+                    sizes[path] = None if entry_type == Fst.TYPE_DIR else size
+                    sources[path] = changes_root_path / path
+
+            dol_offset = align_top(Gcm.APPLOADER_OFFSET + apploader_len, align)
+            fst_offset = align_top(dol_offset + dol_len, align)
+            fst_tree = FstTree(changes_root_path, fst_offset, is_fst_last = True, align = align)
+            # Same sort than --rebuild-fst
+            for path in sorted(sizes, key=lambda s:Path(s.upper())):
+                fst_tree.add_node(path, sizes[path])
+            fstbin_data = fst_tree.generate_fst()
+
+            self.__bootbin.set_dol_offset(dol_offset)
+            self.__bootbin.set_fst_offset(fst_offset)
+            self.__bootbin.set_fst_len(len(fstbin_data))
+            if len(fstbin_data) > self.__bootbin.fst_max_len():
+                self.__bootbin.set_fst_max_len(len(fstbin_data))
+            self.__bootbin.set_user_position(fst_tree.user_position())
+            self.__bootbin.set_user_length(fst_tree.user_length())
+
+            regions = [
+                (0, BootBin.LEN, self.__bootbin.data(), "boot.bin"),
+                (BootBin.LEN, Bi2Bin.LEN, self.__bi2bin.data(), "bi2.bin"),
+                (Gcm.APPLOADER_OFFSET, apploader_len, Gcm.APPLOADER_OFFSET, "apploader.img"),
+                (dol_offset, dol_len, original_dol_offset, "boot.dol"),
+                (fst_offset, len(fstbin_data), fstbin_data, "fst.bin")]
+            new_fst_index = FstIndex(fstbin_data)
+            for id in new_fst_index.files_ids():
+                regions.append( (new_fst_index.offset(id), new_fst_index.size(id), sources[new_fst_index.path(id)], new_fst_index.path(id)) )
+
+            try:
+                with create_gcm(new_iso_path) as new_iso_file:
+                    self.__write_regions(new_iso_file, regions, sparse, iso_file)
+            except OSError:
+                new_iso_path.unlink(missing_ok=True)
+                raise
+    def diff(self, iso_path:Path, modded_iso_path:Path, patch_path:Path):
+        """
+        Write a GcmPatch rebuilding modded_iso_path from iso_path. Files are matched by FST paths:
+        unchanged files and system files are copied from the original GCM/iso, modified files are
+        stored as binary deltas, added files and modified system files are stored raw. Non zero data
+        between files is kept.
+        input: iso_path = Path of the original GCM/iso
+        input: modded_iso_path = Path
+        input: patch_path = Path
+        """
+        if patch_path.is_file():
+            raise InvalidPackIsoError(f"Error - {patch_path} already exist. Remove this file or use another patch name.")
+        with GcmImage(iso_path) as gcm_image, GcmImage(modded_iso_path) as modded_gcm_image, \
+            iso_path.open("rb") as iso_file, modded_iso_path.open("rb") as modded_iso_file, patch_path.open("wb") as patch_file:
+            iso_len = iso_file.seek(0, os.SEEK_END)
+            modded_iso_len = modded_iso_file.seek(0, os.SEEK_END)
+            fst_index = gcm_image.fst_index()
+            modded_fst_index = modded_gcm_image.fst_index()
+            with gcm_image.open("sys/fst.bin") as fst_file:
+                patch_file.write(GcmPatch.HEADER_STRUCT.pack(GcmPatch.MAGIC, GcmPatch.VERSION, iso_len, zlib.crc32(fst_file.read()), modded_iso_len))
+
+            # regions: [(offset, length, relative_path), ...] of the modded GCM/iso
+            regions = [(modded_gcm_image.stat(f"sys/{name}").offset, modded_gcm_image.stat(f"sys/{name}").size, f"sys/{name}") for name in GcmImage.SYS_FILES]
+            extents = set()
+            for id in modded_fst_index.sorted_files_ids():
+                if modded_fst_index.size(id) == 0 or (modded_fst_index.offset(id), modded_fst_index.size(id)) in extents:
+                    continue
+                extents.add( (modded_fst_index.offset(id), modded_fst_index.size(id)) )
+                regions.append( (modded_fst_index.offset(id), modded_fst_index.size(id), f"root/{modded_fst_index.path(id)}") )
+            regions.sort(key=lambda region: region[0])
+
+            # stats: {record type: length, ... }
+            stats = {GcmPatch.RECORD_RAW: 0, GcmPatch.RECORD_COPY: 0, GcmPatch.RECORD_DELTA: 0}
+            zero_block = bytes(Gcm.COPY_BLOCK_LEN)
+            def write_gap(begin_offset:int, end_offset:int):
+                "Keep non zero data between regions by blocks: copied when unchanged or raw."
+                for block_offset in range(begin_offset, end_offset, Gcm.COPY_BLOCK_LEN):
+                    block_len = min(Gcm.COPY_BLOCK_LEN, end_offset - block_offset)
+                    modded_iso_file.seek(block_offset)
+                    block_data = modded_iso_file.read(block_len)
+                    if block_data == zero_block[:block_len]:
+                        continue
+                    iso_file.seek(block_offset)
+                    if iso_file.read(block_len) == block_data:
+                        patch_file.write(GcmPatch.RECORD_STRUCT.pack(GcmPatch.RECORD_COPY, block_offset, block_len) + GcmPatch.OFFSET_STRUCT.pack(block_offset))
+                        stats[GcmPatch.RECORD_COPY] += block_len
+                    else:
+                        patch_file.write(GcmPatch.RECORD_STRUCT.pack(GcmPatch.RECORD_RAW, block_offset, block_len) + block_data)
+                        stats[GcmPatch.RECORD_RAW] += block_len
+
+            covered_offset = 0
+            for offset, length, relative_path in regions:
+                if covered_offset < offset:
+                    write_gap(covered_offset, offset)
+                covered_offset = max(covered_offset, offset + length)
+
+                # src_offset: offset of the same file in the original GCM/iso or None if it's a new file
+                src_offset = None
+                if relative_path[:4] == "sys/":
+                    src_offset = gcm_image.stat(relative_path).offset
+                else:
+                    id = fst_index.get_id(relative_path[5:])
+                    if id is not None and not fst_index.is_dir(id):
+                        src_offset = fst_index.offset(id)
+                if src_offset is None:
+                    logging.debug(f"raw: {relative_path}")
+                    patch_file.write(GcmPatch.RECORD_STRUCT.pack(GcmPatch.RECORD_RAW, offset, length))
+                    with modded_gcm_image.open(relative_path) as modded_file:
+                        data_view = modded_file.getbuffer()
+                        patch_file.write(data_view)
+                        data_view.release()
+                    stats[GcmPatch.RECORD_RAW] += length
+                    continue
+
+                with gcm_image.open(relative_path) as src_file, modded_gcm_image.open(relative_path) as dst_file:
+                    src_view = src_file.getbuffer()
+                    dst_view = dst_file.getbuffer()
+                    if src_view == dst_view:
+                        patch_file.write(GcmPatch.RECORD_STRUCT.pack(GcmPatch.RECORD_COPY, offset, length) + GcmPatch.OFFSET_STRUCT.pack(src_offset))
+                        stats[GcmPatch.RECORD_COPY] += length
+                    elif relative_path[:4] == "sys/":
+                        # changed system files are stored raw
+                        logging.debug(f"raw: {relative_path}")
+                        patch_file.write(GcmPatch.RECORD_STRUCT.pack(GcmPatch.RECORD_RAW, offset, length))
+                        patch_file.write(dst_view)
+                        stats[GcmPatch.RECORD_RAW] += length
+                    else:
+                        logging.debug(f"delta: {relative_path}")
+                        patch_file.write(GcmPatch.RECORD_STRUCT.pack(GcmPatch.RECORD_DELTA, offset, length) + GcmPatch.OFFSET_STRUCT.pack(src_offset))
+                        for op, op_offset, op_len in get_delta_ops(src_view, dst_view, Gcm.DELTA_BLOCK_LEN):
+                            if op == GcmPatch.OP_COPY:
+                                patch_file.write(GcmPatch.OP_STRUCT.pack(op, op_offset) + GcmPatch.OFFSET_STRUCT.pack(op_len))
+                            else:
+                                patch_file.write(GcmPatch.OP_STRUCT.pack(op, op_len))
+                                patch_file.write(dst_view[op_offset:op_offset + op_len])
+                        patch_file.write(GcmPatch.OP_STRUCT.pack(GcmPatch.OP_END, 0))
+                        stats[GcmPatch.RECORD_DELTA] += length
+                    src_view.release()
+                    dst_view.release()
+            if covered_offset < modded_iso_len:
+                write_gap(covered_offset, modded_iso_len)
+            patch_file.write(GcmPatch.RECORD_STRUCT.pack(GcmPatch.RECORD_END, 0, 0))
+            patch_len = patch_file.tell()
+        logging.info(f"Copied: 0x{stats[GcmPatch.RECORD_COPY]:x} bytes, delta: 0x{stats[GcmPatch.RECORD_DELTA]:x} bytes, raw: 0x{stats[GcmPatch.RECORD_RAW]:x} bytes.")
+        logging.info(f"\"{patch_path}\" saved (0x{patch_len:x} bytes).")
+    def apply_patch(self, iso_path:Path, patch_path:Path, new_iso_path:Path):
+        """
+        Rebuild a modded GCM/iso from the original GCM/iso and a GcmPatch written by diff.
+        The patch is read once and the new GCM/iso is written forward. Copies from the
+        original GCM/iso use os.copy_file_range when available.
+        input: iso_path = Path of the original GCM/iso
+        input: patch_path = Path
+        input: new_iso_path = Path
+        """
+        if new_iso_path.is_file():
+            raise InvalidPackIsoError(f"Error - {new_iso_path} already exist. Remove this file or use another GCM file name.")
+        if is_ciso(iso_path):
+            raise CisoNotSupportedError(f"Error - CISO input not supported by --apply-patch: unpack and pack \"{iso_path}\" as GCM/iso.")
+        with iso_path.open("rb") as iso_file, patch_path.open("rb") as patch_file:
+            (magic, version, iso_len, fst_crc32, new_iso_len) = GcmPatch.HEADER_STRUCT.unpack(patch_file.read(GcmPatch.HEADER_STRUCT.size))
+            if magic != GcmPatch.MAGIC or version != GcmPatch.VERSION:
+                raise InvalidPatchError(f"Error - \"{patch_path}\" isn't a GCM/iso patch of version {GcmPatch.VERSION}.")
+            self.__bootbin = BootBin(iso_file.read(BootBin.LEN))
+            original_iso_len = iso_file.seek(0, os.SEEK_END)
+            iso_file.seek(self.__bootbin.fst_offset())
+            if original_iso_len != iso_len or zlib.crc32(iso_file.read(self.__bootbin.fst_len())) != fst_crc32:
+                raise PatchIsoMismatchError(f"Error - \"{iso_path}\" isn't the original GCM/iso of \"{patch_path}\".")
+
+            buffer = memoryview(bytearray(Gcm.COPY_BLOCK_LEN))
+            def copy_patch_data(new_iso_file, length:int):
+                "Copy length bytes of the patch at the current position of new_iso_file."
+                patch_offset = patch_file.tell()
+                self.__copy_range(patch_file, new_iso_file, patch_offset, length, buffer)
+                patch_file.seek(patch_offset + length)
+
+            try:
+                with new_iso_path.open("wb") as new_iso_file:
+                    if hasattr(os, "posix_fallocate"):
+                        os.posix_fallocate(new_iso_file.fileno(), 0, new_iso_len)
+                    else:
+                        new_iso_file.truncate(new_iso_len)
+                    while True:
+                        (record_type, dest_offset, length) = GcmPatch.RECORD_STRUCT.unpack(patch_file.read(GcmPatch.RECORD_STRUCT.size))
+                        if record_type == GcmPatch.RECORD_END:
+                            break
+                        new_iso_file.seek(dest_offset)
+                        if record_type == GcmPatch.RECORD_RAW:
+                            copy_patch_data(new_iso_file, length)
+                            continue
+                        (src_offset,) = GcmPatch.OFFSET_STRUCT.unpack(patch_file.read(GcmPatch.OFFSET_STRUCT.size))
+                        if record_type == GcmPatch.RECORD_COPY:
+                            self.__copy_range(iso_file, new_iso_file, src_offset, length, buffer)
+                            continue
+                        while True:
+                            (op, op_value) = GcmPatch.OP_STRUCT.unpack(patch_file.read(GcmPatch.OP_STRUCT.size))
+                            if op == GcmPatch.OP_END:
+                                break
+                            if op == GcmPatch.OP_COPY:
+                                (op_len,) = GcmPatch.OFFSET_STRUCT.unpack(patch_file.read(GcmPatch.OFFSET_STRUCT.size))
+                                self.__copy_range(iso_file, new_iso_file, src_offset + op_value, op_len, buffer)
+                            else:
+                                copy_patch_data(new_iso_file, op_value)
+            except (OSError, struct.error):
+                new_iso_path.unlink(missing_ok=True)
+                raise
+        logging.info(f"\"{new_iso_path}\" saved (0x{new_iso_len:x} bytes).")
+    def extract(self, iso_path:Path, pattern:str, dest_path:Path = None):
+        """
+        Extract files of the GCM/iso without unpacking it: only theirs data are read.
+        pattern is a FST path ("snd/a.afs" or "root/snd/a.afs") or a system file ("sys/boot.dol").
+        When pattern is a glob (* also matches /) all matching files are extracted in dest_path
+        keeping the unpacked folder tree ("root/snd/a.afs").
+        input: iso_path = Path
+        input: pattern = str
+        input: dest_path = Path (dest file or folder, default is the current folder)
+        """
+        with GcmImage(iso_path) as gcm_image:
+            pattern = pattern.replace("\\", "/").strip("/")
+            # extracted_list: [(image path, dest file path), ...]
+            extracted_list = []
+            if any(char in pattern for char in "*?["):
+                dest_path = Path(".") if dest_path is None else dest_path
+                for dirpath, _, filenames in gcm_image.walk():
+                    for filename in filenames:
+                        path = f"{dirpath}/{filename}"
+                        if fnmatchcase(path, pattern) or (path[:5] == "root/" and fnmatchcase(path[5:], pattern)):
+                            extracted_list.append( (path, dest_path / path) )
+                if not extracted_list:
+                    raise FileNotFoundError(f"Error - No file matching \"{pattern}\" in \"{iso_path}\".")
+            else:
+                path = pattern
+                if pattern[:4] != "sys/" and pattern[:5] != "root/":
+                    path = f"root/{pattern}"
+                if gcm_image.stat(path).is_dir:
+                    raise IsADirectoryError(f"Error - \"{path}\" is a folder: use a glob like \"{path}/*\".")
+                if dest_path is None:
+                    dest_path = Path(path.split("/")[-1])
+                elif dest_path.is_dir():
+                    dest_path = dest_path / path.split("/")[-1]
+                extracted_list.append( (path, dest_path) )
+
+            for path, file_path in extracted_list:
+                if file_path.exists():
+                    raise InvalidExtractPathError(f"Error - \"{file_path}\" already exist. Remove this file or use another dest.")
+            for path, file_path in extracted_list:
+                entry_stat = gcm_image.stat(path)
+                logging.debug(f"{iso_path}(0x{entry_stat.offset:x}:0x{entry_stat.offset + entry_stat.size:x}) -> {file_path}")
+                file_path.parent.mkdir(parents=True, exist_ok=True)
+                with gcm_image.open(path) as image_file:
+                    data_view = image_file.getbuffer()
+                    try:
+                        file_path.write_bytes(data_view)
+                    finally:
+                        data_view.release()
+        logging.info(f"{len(extracted_list)} files extracted from \"{iso_path}\".")
+    def __get_hash_manifest(self, path:Path, jobs:int = 1):
+        """
+        Hash system files and FST files of a GCM/iso or of an unpacked folder.
+        Files are hashed by jobs threads: GCM/iso files in ascending offsets order
+        for sequential reads in the memory mapped GCM/iso.
+        input: path = Path (folder or iso/GCM file)
+        input: jobs = int
+        return HashManifest
+        """
+        def hash_file(open_file):
+            buffer = memoryview(bytearray(Manifest.BLOCK_LEN))
+            with open_file() as file:
+                return get_file_hashes(file, buffer)
+
+        hash_manifest = HashManifest()
+        if path.is_dir():
+            folder_snapshot = FolderSnapshot(path / "root")
+            relative_paths = [f"sys/{name}" for name in GcmImage.SYS_FILES] + \
+                [f"root/{relative_path}" for relative_path in sorted(folder_snapshot.paths()) if folder_snapshot.get(relative_path)[0] == Fst.TYPE_FILE]
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                hashes_list = executor.map(lambda relative_path: hash_file(lambda: (path / relative_path).open("rb")), relative_paths)
+                for relative_path, hashes in zip(relative_paths, hashes_list):
+                    hash_manifest.add(relative_path, *hashes)
+            return hash_manifest
+
+        with GcmImage(path) as gcm_image:
+            fst_index = gcm_image.fst_index()
+            relative_paths = [f"sys/{name}" for name in GcmImage.SYS_FILES] + \
+                [f"root/{fst_index.path(id)}" for id in fst_index.sorted_files_ids()]
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                hashes_list = executor.map(lambda relative_path: hash_file(lambda: gcm_image.open(relative_path)), relative_paths)
+                for relative_path, hashes in zip(relative_paths, hashes_list):
+                    hash_manifest.add(relative_path, *hashes)
+        return hash_manifest
+    def hash(self, path:Path, manifest_path:Path, jobs:int = 1):
+        """
+        Write the crc32 and sha1 of system files and FST files of a GCM/iso or of an unpacked folder in manifest_path.
+        input: path = Path (folder or iso/GCM file)
+        input: manifest_path = Path
+        input: jobs = int (threads count used to hash files)
+        """
+        hash_manifest = self.__get_hash_manifest(path, jobs)
+        hash_manifest.save(manifest_path)
+        logging.info(f"{len(hash_manifest.entries())} files hashed in \"{path}\".")
+    def verify(self, manifest_path:Path, path:Path, jobs:int = 1):
+        """
+        Print files added, removed or modified in a GCM/iso or an unpacked folder compared to a --hash manifest.
+        input: manifest_path = Path
+        input: path = Path (folder or iso/GCM file)
+        input: jobs = int (threads count used to hash files)
+        return [(status, relative_path), ...]
+        """
+        hash_manifest = HashManifest()
+        hash_manifest.load(manifest_path)
+        differences = hash_manifest.get_differences(self.__get_hash_manifest(path, jobs))
+        for difference in differences:
+            print(f"{difference[0]:8}: {difference[1]}")
+        if differences:
+            logging.warning(f"{len(differences)} differences between \"{manifest_path}\" and \"{path}\".")
+        else:
+            logging.info(f"\"{path}\" matches \"{manifest_path}\".")
+        return differences
+    def status(self, folder_path:Path):
+        """
+        Print files added, removed or modified since the unpack using sys/manifest.
+        input: folder_path = Path
+        """
+        manifest = Manifest(folder_path)
+        manifest.load()
+        changes = manifest.get_changes()
+        for change in changes:
+            print(f"{change[0]:8}: {change[1]}")
+        if not changes:
+            logging.info(f"No changes in \"{folder_path}\" since unpack.")
+    def patch(self, iso_path:Path, folder_path:Path, align:int = 4):
+        """
+        Patch in place the GCM/iso used to unpack folder_path with root files modified since unpack.
+        Modified files are found using sys/manifest. A file is written in the GCM/iso when its new length
+        aligned with align fits before the next file (or system file) offset. FST sizes are updated in the
+        GCM/iso and in sys/fst.bin. Files that don't fit, added and removed files are reported.
+        Nothing is written if sys/fst.bin is different from the GCM/iso FST (--rebuild-fst since unpack).
+        input: iso_path = Path
+        input: folder_path = Path
+        input: align = int
+        """
+        if is_ciso(iso_path):
+            raise CisoNotSupportedError(f"Error - CISO input not supported by --patch: unpack and pack \"{iso_path}\" as GCM/iso.")
+        manifest = Manifest(folder_path)
+        manifest.load()
+
+        with iso_path.open("rb+") as iso_file:
+            self.__bootbin = BootBin(iso_file.read(BootBin.LEN))
+            if self.__bootbin.dvd_magic() != Gcm.DVD_MAGIC:
+                raise InvalidDVDMagicError("Error - Invalid DVD format - this tool is for ISO/GCM files.")
+            fstbin_offset = self.__bootbin.fst_offset()
+            iso_file.seek(fstbin_offset)
+            fstbin_data = bytearray(iso_file.read(self.__bootbin.fst_len()))
+            if "sys/fst.bin" not in manifest.entries() or manifest.entries()["sys/fst.bin"][3] != zlib.crc32(fstbin_data):
+                raise PatchIsoMismatchError(f"Error - The FST of \"{iso_path}\" doesn't match \"{folder_path / 'sys' / 'manifest'}\": patch the GCM/iso used to unpack the folder.")
+            # the folder FST doesn't describe the GCM/iso anymore: it can't be updated with patched sizes
+            fstbin_path = folder_path / "sys" / "fst.bin"
+            if not fstbin_path.is_file() or fstbin_path.read_bytes() != fstbin_data:
+                raise PatchFstModifiedError(f"Error - \"{fstbin_path}\" has been modified since unpack: use --pack or unpack the GCM/iso again.")
+            fst_index = FstIndex(fstbin_data)
+            iso_len = iso_file.seek(0, os.SEEK_END)
+
+            # every regions begin offsets to find the next offset after a file
+            begin_offsets = sorted(set([fst_index.offset(id) for id in fst_index.files_ids()] + \
+                [BootBin.LEN, Gcm.APPLOADER_OFFSET, fstbin_offset, self.__bootbin.dol_offset(), iso_len]))
+            # extents_count: {(offset, size): files count, ... } files data shared by many files (--dedupe)
+            extents_count = {}
+            for id in fst_index.files_ids():
+                extent = (fst_index.offset(id), fst_index.size(id))
+                extents_count[extent] = extents_count.get(extent, 0) + 1
+
+            buffer = memoryview(bytearray(Gcm.COPY_BLOCK_LEN))
+            not_patched = []
+            patched_count = 0
+            for status, relative_path in manifest.get_changes():
+                id = fst_index.get_id(relative_path[5:]) if relative_path[:5] == "root/" else None
+                if status != "modified" or id is None:
+                    not_patched.append(f"{status:8}: {relative_path} - use --rebuild-fst and --pack.")
+                    continue
+                file_offset = fst_index.offset(id)
+                file_len = (folder_path / relative_path).stat().st_size
+                if fst_index.size(id) > 0 and extents_count[(file_offset, fst_index.size(id))] > 1:
+                    not_patched.append(f"modified: {relative_path} - data shared with others files (--dedupe) - use --rebuild-fst and --pack.")
+                    continue
+                next_offset = begin_offsets[bisect_right(begin_offsets, file_offset)] if file_offset < iso_len else iso_len
+                if align_top(file_offset + file_len, align) > next_offset:
+                    not_patched.append(f"modified: {relative_path} - new length 0x{file_len:x} overflow on next offset 0x{next_offset:x} (slot length 0x{next_offset - file_offset:x}) - use --rebuild-fst and --pack.")
+                    continue
+
+                logging.debug(f"{folder_path / relative_path} -> {iso_path}(0x{file_offset:x}:0x{file_offset + file_len:x})")
+                iso_file.seek(file_offset)
+                self.__copy_file(folder_path / relative_path, iso_file, buffer)
+                # Clean the end of the old file
+                if file_len < fst_index.size(id):
+                    iso_file.write(bytes(fst_index.size(id) - file_len))
+                fstbin_data[id*12+8:id*12+12] = file_len.to_bytes(4, "big")
+                manifest.add_crc32(relative_path, file_offset, file_len, get_file_crc32(folder_path / relative_path))
+                patched_count += 1
+
+            if patched_count > 0:
+                iso_file.seek(fstbin_offset)
+                iso_file.write(fstbin_data)
+                (folder_path / "sys" / "fst.bin").write_bytes(fstbin_data)
+                manifest.add("sys/fst.bin", fstbin_offset, fstbin_data)
+                manifest.save()
+        logging.info(f"{patched_count} files patched in \"{iso_path}\".")
+        if not_patched:
+            logging.warning(f"{len(not_patched)} changes not patched:\n" + "\n".join(not_patched))
     def __get_sys_from_folder(self, folder_path:Path):
         """
         Load system files from an unpacked GCM/iso folder and returns informations for the stats command.
@@ -1041,7 +2484,7 @@ class Gcm:
         """
         dol_len = None
         fstbin_data = None
-        with file_path.open("rb") as iso_file:
+        with open_gcm(file_path) as iso_file:
             self.__bootbin = BootBin(iso_file.read(BootBin.LEN))
             self.__bi2bin = Bi2Bin(iso_file.read(Bi2Bin.LEN))
             
@@ -1056,49 +2499,51 @@ class Gcm:
             iso_file.seek( self.__bootbin.fst_offset() )
             fstbin_data = iso_file.read(self.__bootbin.fst_len())
         return (dol_len, fstbin_data)
-    def stats(self, path:Path, align:int = 4):
+    def stats(self, path:Path, align:int = 4, stats_format:str = "txt"):
         """
-        Print SYS files informations, global memory mapping, empty spaces inside the GCM/iso
+        Print SYS files informations, global memory mapping, empty spaces inside the GCM/iso,
+        collisions, shared data and duplicated data. Extents are swept by offsets with a heap of
+        the extents still open so every overlapping pair is found even with nested extents.
         input:
         * path = Path (folder or iso/GCM file)
         * align = int
+        * stats_format = "txt" for tables or "json" to stream one json record per line
         """
         (dol_len, fstbin_data) = self.__get_sys_from_folder(path) if path.is_dir() else self.__get_sys_from_file(path)
 
-        global_stats = f"# Stats for \"{path}\":\n\n" + \
-            "[boot.bin]\n" + \
-            f"GameCode = {self.__bootbin.game_code()}\n" + \
-            f"MakerCode = {self.__bootbin.maker_code()}\n" + \
-            f"DiscNumber = {self.__bootbin.disc_number()}\n" + \
-            f"GameVersion = {self.__bootbin.game_version()}\n" + \
-            f"AudioStreaming = {self.__bootbin.audio_streaming()}\n" + \
-            f"StreamBufferSize = {self.__bootbin.stream_buffer_size()}\n" + \
-            f"DVDMagic = 0x{self.__bootbin.dvd_magic().hex()}\n" + \
-            f"GameName = {self.__bootbin.game_name()}\n" + \
-            f"DolOffset = 0x{self.__bootbin.dol_offset():x}\n" + \
-            f"FstOffset = 0x{self.__bootbin.fst_offset():x}\n" + \
-            f"FstLen = 0x{self.__bootbin.fst_len():x}\n" + \
-            f"FstMaxLen = 0x{self.__bootbin.fst_max_len():x}\n" + \
-            f"UserPosition = 0x{self.__bootbin.user_position():x}\n" + \
-            f"UserLength = 0x{self.__bootbin.user_length():x}\n\n" + \
-            "[bi2.bin]\n" + \
-            f"DebugMonitorSize = 0x{self.__bi2bin.debug_monitor_size():x}\n" + \
-            f"SimulatedMemorySize = 0x{self.__bi2bin.simulated_memory_size():x}\n" + \
-            f"ArgumentOffset = 0x{self.__bi2bin.argument_offset():x}\n" + \
-            f"DebugFlag = {self.__bi2bin.debug_flag()}\n" + \
-            f"TrackLocation = 0x{self.__bi2bin.track_location():x}\n" + \
-            f"TrackSize = 0x{self.__bi2bin.track_size():x}\n" + \
-            f"CountryCode = {self.__bi2bin.country_code()}\n" + \
-            f"TotalDisc = {self.__bi2bin.total_disc()}\n" + \
-            f"LongFileNameSupport = {self.__bi2bin.long_file_name_support()}\n" + \
-            f"DolLimit = 0x{self.__bi2bin.dol_limit():x}\n\n" + \
-            "[apploader.img]\n" + \
-            f"Version = {self.__apploaderimg.version()}\n" + \
-            f"EntryPoint = 0x{self.__apploaderimg.entry_point():x}\n" + \
-            f"Size = 0x{self.__apploaderimg.size():x}\n" + \
-            f"TrailerSize = 0x{self.__apploaderimg.trailer_size():x}\n"
-
-        print(global_stats)
+        # conf_dict: {section: {key: value, ... }, ... } same values than sys/system.conf
+        conf_dict = {
+            "boot.bin": {
+                "GameCode": self.__bootbin.game_code(),
+                "MakerCode": self.__bootbin.maker_code(),
+                "DiscNumber": self.__bootbin.disc_number(),
+                "GameVersion": self.__bootbin.game_version(),
+                "AudioStreaming": self.__bootbin.audio_streaming(),
+                "StreamBufferSize": self.__bootbin.stream_buffer_size(),
+                "DVDMagic": f"0x{self.__bootbin.dvd_magic().hex()}",
+                "GameName": self.__bootbin.game_name(),
+                "DolOffset": f"0x{self.__bootbin.dol_offset():x}",
+                "FstOffset": f"0x{self.__bootbin.fst_offset():x}",
+                "FstLen": f"0x{self.__bootbin.fst_len():x}",
+                "FstMaxLen": f"0x{self.__bootbin.fst_max_len():x}",
+                "UserPosition": f"0x{self.__bootbin.user_position():x}",
+                "UserLength": f"0x{self.__bootbin.user_length():x}"},
+            "bi2.bin": {
+                "DebugMonitorSize": f"0x{self.__bi2bin.debug_monitor_size():x}",
+                "SimulatedMemorySize": f"0x{self.__bi2bin.simulated_memory_size():x}",
+                "ArgumentOffset": f"0x{self.__bi2bin.argument_offset():x}",
+                "DebugFlag": self.__bi2bin.debug_flag(),
+                "TrackLocation": f"0x{self.__bi2bin.track_location():x}",
+                "TrackSize": f"0x{self.__bi2bin.track_size():x}",
+                "CountryCode": self.__bi2bin.country_code(),
+                "TotalDisc": self.__bi2bin.total_disc(),
+                "LongFileNameSupport": self.__bi2bin.long_file_name_support(),
+                "DolLimit": f"0x{self.__bi2bin.dol_limit():x}"},
+            "apploader.img": {
+                "Version": self.__apploaderimg.version(),
+                "EntryPoint": f"0x{self.__apploaderimg.entry_point():x}",
+                "Size": f"0x{self.__apploaderimg.size():x}",
+                "TrailerSize": f"0x{self.__apploaderimg.trailer_size():x}"}}
 
         class MemoryObject:
             def __init__(self, name:str, beg_offset:int, length:int):
@@ -1116,55 +2561,117 @@ class Gcm:
             MemoryObject("fst.bin", self.__bootbin.fst_offset(), self.__bootbin.fst_len()),
             MemoryObject("boot.dol", self.__bootbin.dol_offset(), dol_len)]
 
-        dir_id_path = {0: Path(".")}
-        currentdir_path = Path(".")
-
-        # root: id=0 so nextdir is the end
-        nextdir = int.from_bytes(fstbin_data[8:12], "big")
-        # offset of filenames block
-        base_names = nextdir * 12
-        # go to parent when id reach next dir
-        nextdir_arr = [ nextdir ]
-
-        for id in range(1, base_names // 12):
-            i = id * 12
-            file_type = int.from_bytes(fstbin_data[i:i+1], "big")
-            name = fstbin_data[base_names + int.from_bytes(fstbin_data[i+1:i+4], "big"):].split(b"\x00")[0].decode("utf-8")
-            
-            while id == nextdir_arr[-1]:
-                currentdir_path = currentdir_path.parent
-                nextdir_arr.pop()
-
-            if file_type == FstTree.TYPE_DIR:
-                nextdir = int.from_bytes(fstbin_data[i+8:i+12], "big")
-                parentdir = int.from_bytes(fstbin_data[i+4:i+8], "big")
-
-                nextdir_arr.append( nextdir )
-                currentdir_path = dir_id_path[parentdir] / name
-                dir_id_path[id] = currentdir_path
-            else:
-                fileoffset = int.from_bytes(fstbin_data[i+4:i+8], "big")
-                filesize   = int.from_bytes(fstbin_data[i+8:i+12], "big")
-                mem_obj_list.append( MemoryObject(str(currentdir_path / name), fileoffset, filesize) )
+        fst_index = FstIndex(fstbin_data)
+        for id in fst_index.files_ids():
+            mem_obj_list.append( MemoryObject(fst_index.path(id), fst_index.offset(id), fst_index.size(id)) )
 
         mem_obj_list.sort(key=lambda x: x.beg_offset)
 
         empty_space_list = []
+        # collision_list: [(MemoryObject, MemoryObject), ...] every overlapping pairs
         collision_list = []
-        last_mem_obj = mem_obj_list[2]
-        for mem_obj in mem_obj_list[3:]:
-            last_aligned = align_top(last_mem_obj.end_offset, align)
-            if last_aligned < mem_obj.beg_offset:
-                empty_space_list.append( MemoryObject("", last_aligned, mem_obj.beg_offset - last_aligned) )
-            elif last_aligned > mem_obj.beg_offset:
-                collision_list += [last_mem_obj, mem_obj]
-            last_mem_obj = mem_obj
-        
+        # shared_dict: {(offset, length): [MemoryObject, ...], ... } files sharing the same data (--dedupe)
+        shared_dict = {}
+        # extents_dict: {(offset, length): MemoryObject, ... } first object of each extent
+        extents_dict = {}
+        # open_heap: [(aligned end offset, position), ...] objects which can overlap the next ones
+        open_heap = []
+        max_aligned_end = None
+        for pos in range(len(mem_obj_list)):
+            mem_obj = mem_obj_list[pos]
+            # empty files don't use space so they can't overlap
+            if mem_obj.length == 0:
+                continue
+            extent = (mem_obj.beg_offset, mem_obj.length)
+            if extent in extents_dict:
+                shared_dict.setdefault(extent, [extents_dict[extent]]).append(mem_obj)
+                continue
+            extents_dict[extent] = mem_obj
+            while open_heap and open_heap[0][0] <= mem_obj.beg_offset:
+                heappop(open_heap)
+            if max_aligned_end is not None and max_aligned_end < mem_obj.beg_offset:
+                empty_space_list.append( MemoryObject("", max_aligned_end, mem_obj.beg_offset - max_aligned_end) )
+            for _, open_pos in sorted(open_heap, key=lambda open_obj: open_obj[1]):
+                collision_list.append( (mem_obj_list[open_pos], mem_obj) )
+            aligned_end = align_top(mem_obj.end_offset, align)
+            heappush(open_heap, (aligned_end, pos))
+            max_aligned_end = aligned_end if max_aligned_end is None else max(max_aligned_end, aligned_end)
+        largest_empty_space_list = sorted(empty_space_list, key=lambda mem_obj: -mem_obj.length)[:Gcm.LARGEST_EMPTY_SPACES_COUNT]
+
+        duplicated_list = self.__get_duplicated_data(path, fst_index)
+
+        if stats_format == "json":
+            fields = ["gcm", "type", "name", "offset", "end_offset", "length", "other_name"]
+            write_record = lambda record_type, mem_obj, other_name = None: print(json.dumps(dict(zip(fields,
+                (str(path), record_type, mem_obj.name, mem_obj.beg_offset, mem_obj.end_offset, mem_obj.length, other_name)))))
+            print(json.dumps({"gcm": str(path), "type": "conf", "conf": conf_dict}))
+            for mem_obj in mem_obj_list:
+                write_record("entry", mem_obj)
+            for mem_obj in empty_space_list:
+                write_record("empty_space", mem_obj)
+            for mem_obj1, mem_obj2 in collision_list:
+                write_record("collision", mem_obj2, mem_obj1.name)
+            for mem_objs in shared_dict.values():
+                for mem_obj in mem_objs[1:]:
+                    write_record("shared", mem_obj, mem_objs[0].name)
+            for ids in duplicated_list:
+                for id in ids[1:]:
+                    write_record("duplicated", MemoryObject(fst_index.path(id), fst_index.offset(id), fst_index.size(id)), fst_index.path(ids[0]))
+            return
+
+        print(f"# Stats for \"{path}\":\n\n" + "\n".join(f"[{section}]\n" + \
+            "".join(f"{key} = {value}\n" for key, value in values.items()) for section, values in conf_dict.items()))
+
         self.__print("Global memory mapping:", mem_obj_list)
         if empty_space_list:
             self.__print(f"Empty spaces (align={align}):", empty_space_list)
+            self.__print(f"Largest empty spaces (align={align}):", largest_empty_space_list)
         if collision_list:
-            self.__print(f"Collisions (align={align}):", collision_list)
+            self.__print(f"Collisions (align={align}):", [mem_obj for mem_objs in collision_list for mem_obj in mem_objs])
+        if shared_dict:
+            self.__print("Shared data:", [mem_obj for mem_objs in shared_dict.values() for mem_obj in mem_objs])
+            shared_length = sum(length * (len(mem_objs) - 1) for (_, length), mem_objs in shared_dict.items())
+            print(f"Shared data saves 0x{shared_length:x} bytes.\n")
+        if duplicated_list:
+            self.__print("Duplicated data:", [MemoryObject(fst_index.path(id), fst_index.offset(id), fst_index.size(id)) for ids in duplicated_list for id in ids])
+            duplicated_length = sum(fst_index.size(ids[0]) * (len(ids) - 1) for ids in duplicated_list)
+            print(f"Duplicated data takes 0x{duplicated_length:x} bytes: use --rebuild-fst --dedupe to share it.")
+    def __get_duplicated_data(self, path:Path, fst_index:FstIndex):
+        """
+        Find files with the same content stored at different offsets. Only files with the same length are hashed.
+        input: path = Path (folder or iso/GCM file)
+        input: fst_index = FstIndex
+        return [[id, ...], ...] groups of files ids with the same content
+        """
+        # sizes_dict: {size: {offset: id, ... }, ... } one file per distinct data
+        sizes_dict = {}
+        for id in fst_index.files_ids():
+            if fst_index.size(id) > 0:
+                sizes_dict.setdefault(fst_index.size(id), {}).setdefault(fst_index.offset(id), id)
+
+        iso_file = None if path.is_dir() else open_gcm(path)
+        try:
+            duplicated_list = []
+            for size, offsets_dict in sizes_dict.items():
+                if len(offsets_dict) < 2:
+                    continue
+                # sha1_dict: {sha1: [id, ...], ... }
+                sha1_dict = {}
+                for offset, id in offsets_dict.items():
+                    if iso_file is None:
+                        sha1 = get_file_sha1(path / "root" / fst_index.path(id))
+                    else:
+                        sha1 = hashlib.sha1()
+                        iso_file.seek(offset)
+                        for _ in range(0, size, Manifest.BLOCK_LEN):
+                            sha1.update(iso_file.read(min(Manifest.BLOCK_LEN, offset + size - iso_file.tell())))
+                        sha1 = sha1.digest()
+                    sha1_dict.setdefault(sha1, []).append(id)
+                duplicated_list += [ids for ids in sha1_dict.values() if len(ids) > 1]
+            return duplicated_list
+        finally:
+            if iso_file is not None:
+                iso_file.close()
     def __print(self, title:str, mem_obj_list):
         """
         Print a table with a title.
@@ -1175,25 +2682,218 @@ class Gcm:
         print(full_title + "\n".join([str(mem_obj) for mem_obj in mem_obj_list]))
 
 
-def pack(p_input:Path, p_output:Path, disable_ignore:bool, skip_conf:bool = False):
+class GcmImageStat:
+    """
+    GcmImageStat describes an entry of a GcmImage returned by GcmImage.stat.
+    offset and size are 0 for folders.
+    """
+    def __init__(self, path:str, is_dir:bool, offset:int = 0, size:int = 0):
+        self.path = path
+        self.is_dir = is_dir
+        self.offset = offset
+        self.size = size
+    def __repr__(self):
+        return f"GcmImageStat(path={self.path!r}, is_dir={self.is_dir}, offset=0x{self.offset:x}, size=0x{self.size:x})"
+
+
+class GcmImageFile(io.RawIOBase):
+    """
+    GcmImageFile is a read-only seekable file object over a file of a GcmImage.
+    Reads are done in the memory mapped GCM/iso without reading others files.
+    getbuffer() returns the zero-copy memoryview of the whole file: release it before closing the GcmImage.
+    Constructor: view = memoryview of the file data, name = str
+    """
+    __view = None
+    __position = 0
+    def __init__(self, view:memoryview, name:str):
+        super().__init__()
+        self.__view = view
+        self.name = name
+    def readable(self): return True
+    def seekable(self): return True
+    def getbuffer(self):
+        self._checkClosed()
+        return self.__view[:]
+    def readinto(self, buffer):
+        self._checkClosed()
+        data = self.__view[self.__position:self.__position + len(buffer)]
+        memoryview(buffer).cast("B")[:len(data)] = data
+        self.__position += len(data)
+        return len(data)
+    def read(self, size:int = -1):
+        "return bytes copied once from the memory mapped GCM/iso"
+        self._checkClosed()
+        end = len(self.__view) if size is None or size < 0 else min(self.__position + size, len(self.__view))
+        data = self.__view[self.__position:end].tobytes()
+        self.__position += len(data)
+        return data
+    def readall(self): return self.read()
+    def seek(self, offset:int, whence:int = io.SEEK_SET):
+        self._checkClosed()
+        if whence == io.SEEK_CUR:
+            offset += self.__position
+        elif whence == io.SEEK_END:
+            offset += len(self.__view)
+        elif whence != io.SEEK_SET:
+            raise ValueError(f"Invalid whence ({whence}).")
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}.")
+        self.__position = offset
+        return offset
+    def tell(self):
+        self._checkClosed()
+        return self.__position
+    def close(self):
+        if not self.closed:
+            self.__view.release()
+        super().close()
+
+
+class GcmImage:
+    """
+    GcmImage gives a random access to the files of a GCM/iso without unpacking it.
+    The GCM/iso is memory mapped and the FST is parsed once. Paths use the unpacked
+    folder tree: "sys/boot.bin", "sys/bi2.bin", "sys/apploader.img", "sys/fst.bin",
+    "sys/boot.dol" and "root/<FST path>" ("" is the top folder containing sys and root).
+    Constructor: iso_path = Path
+    """
+    SYS_FILES = ["boot.bin", "bi2.bin", "apploader.img", "fst.bin", "boot.dol"]
+    __iso_file = None
+    __mmap = None
+    __view = None
+    __bootbin = None
+    __fst_index = None
+    # sys_dict: {name: (offset, length), ... }
+    __sys_dict = None
+    # opened GcmImageFile closed with the GcmImage
+    __files = None
+    def __init__(self, iso_path:Path):
+        self.__iso_file = iso_path.open("rb")
+        try:
+            self.__mmap = mmap.mmap(self.__iso_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.__view = memoryview(self.__mmap)
+            if self.__view[:4] == Ciso.MAGIC:
+                raise CisoNotSupportedError(f"Error - CISO input not supported by --extract, --hash and --diff: unpack and pack \"{iso_path}\" as GCM/iso.")
+            self.__bootbin = BootBin(self.__view[:BootBin.LEN].tobytes())
+            if self.__bootbin.dvd_magic() != Gcm.DVD_MAGIC:
+                raise InvalidDVDMagicError("Error - Invalid DVD format - this tool is for ISO/GCM files.")
+            apploader_len = Gcm.APPLOADER_HEADER_LEN + \
+                int.from_bytes(self.__view[Gcm.APPLOADERLEN_OFFSET:Gcm.APPLOADERLEN_OFFSET+4], "big") + \
+                int.from_bytes(self.__view[Gcm.APPLOADERLEN_OFFSET+4:Gcm.APPLOADERLEN_OFFSET+8], "big")
+            dol_offset = self.__bootbin.dol_offset()
+            self.__sys_dict = {
+                "boot.bin": (0, BootBin.LEN),
+                "bi2.bin": (BootBin.LEN, Bi2Bin.LEN),
+                "apploader.img": (Gcm.APPLOADER_OFFSET, apploader_len),
+                "fst.bin": (self.__bootbin.fst_offset(), self.__bootbin.fst_len()),
+                "boot.dol": (dol_offset, Dol().get_dol_len(self.__view[dol_offset:dol_offset + Dol.HEADER_LEN]))}
+            self.__fst_index = FstIndex(self.__view[self.__bootbin.fst_offset():self.__bootbin.fst_offset() + self.__bootbin.fst_len()])
+            self.__files = weakref.WeakSet()
+        except Exception:
+            self.close()
+            raise
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc_value, traceback): self.close()
+    def bootbin(self):   return self.__bootbin
+    def fst_index(self): return self.__fst_index
+    def close(self):
+        "close opened files and unmap the GCM/iso"
+        if self.__files is not None:
+            for file in list(self.__files):
+                file.close()
+        if self.__view is not None:
+            self.__view.release()
+        if self.__mmap is not None:
+            self.__mmap.close()
+        self.__iso_file.close()
+    def __get_entry(self, path:str):
+        """
+        Find an entry of the GCM/iso.
+        input: path = str
+        return (path:str, "dir" or "sys" or "root", name or FST id)
+        """
+        path = path.replace("\\", "/").strip("/")
+        if path in ("", "sys"):
+            return (path, "dir", path)
+        if path[:4] == "sys/" and path[4:] in self.__sys_dict:
+            return (path, "sys", path[4:])
+        if path == "root" or path[:5] == "root/":
+            id = self.__fst_index.get_id(path[5:])
+            if id is not None:
+                return (path, "root", id)
+        raise FileNotFoundError(f"Error - \"{path}\" not found in the GCM/iso.")
+    def listdir(self, path:str = ""):
+        "return names of the folder entries in FST order"
+        path, kind, key = self.__get_entry(path)
+        if kind == "dir":
+            return ["sys", "root"] if path == "" else GcmImage.SYS_FILES[:]
+        if kind == "sys" or not self.__fst_index.is_dir(key):
+            raise NotADirectoryError(f"Error - \"{path}\" is not a folder.")
+        return [self.__fst_index.path(id).split("/")[-1] for id in self.__fst_index.childs_ids(key)]
+    def stat(self, path:str):
+        "return GcmImageStat of the entry"
+        path, kind, key = self.__get_entry(path)
+        if kind == "dir":
+            return GcmImageStat(path, True)
+        if kind == "sys":
+            return GcmImageStat(path, False, *self.__sys_dict[key])
+        if self.__fst_index.is_dir(key):
+            return GcmImageStat(path, True)
+        return GcmImageStat(path, False, self.__fst_index.offset(key), self.__fst_index.size(key))
+    def walk(self, top:str = ""):
+        "yield (dirpath, dirnames, filenames) top-down like os.walk"
+        top = top.replace("\\", "/").strip("/")
+        dirnames = []
+        filenames = []
+        for name in self.listdir(top):
+            (dirnames if self.stat(f"{top}/{name}").is_dir else filenames).append(name)
+        yield (top, dirnames, filenames)
+        for name in dirnames:
+            yield from self.walk(f"{top}/{name}" if top else name)
+    def open(self, path:str):
+        "return a GcmImageFile read-only seekable file object"
+        entry_stat = self.stat(path)
+        if entry_stat.is_dir:
+            raise IsADirectoryError(f"Error - \"{entry_stat.path}\" is a folder.")
+        if entry_stat.offset + entry_stat.size > len(self.__view):
+            raise InvalidFSTFileSizeError(f"Error - \"{entry_stat.path}\" (0x{entry_stat.offset:x}:0x{entry_stat.offset + entry_stat.size:x}) is outside of the GCM/iso.")
+        file = GcmImageFile(self.__view[entry_stat.offset:entry_stat.offset + entry_stat.size], entry_stat.path)
+        self.__files.add(file)
+        return file
+
+
+def pack(p_input:Path, p_output:Path, disable_ignore:bool, skip_conf:bool = False, sparse:bool = False):
     logging.info("### Pack in new GCM iso")
     if(p_output == Path(".")):
         p_output = Path(p_input.with_suffix(".iso"))
     logging.info(f"Packing folder \"{p_input}\" in \"{p_output}\"")
-    gcm.pack(p_input, p_output, disable_ignore, skip_conf)
+    gcm.pack(p_input, p_output, disable_ignore, skip_conf, sparse)
 
 
-def unpack(p_input:Path, p_output:Path):
+def unpack(p_input:Path, p_output:Path, jobs:int = 1):
     logging.info("### Unpack GCM iso in new folder")
-    gcm.unpack(p_input, p_output)
+    if jobs < 1:
+        raise BadJobsError("Error - Jobs must be > 0.")
+    gcm.unpack(p_input, p_output, jobs)
 
 
-def rebuild_fst(p_input:Path, align:int, skip_conf:bool = False):
+def hash_jobs(jobs:int = None):
+    "return the threads count used to hash files: the CPU count by default"
+    if jobs is None:
+        return os.cpu_count() or 1
+    if jobs < 1:
+        raise BadJobsError("Error - Jobs must be > 0.")
+    return jobs
+
+
+def rebuild_fst(p_input:Path, align:int, skip_conf:bool = False, preserve_layout:bool = False, trace_path:Path = None, dedupe:bool = False):
     logging.info("### Rebuilding FST and patching boot.bin")
     if args.align < 1:
         raise BadAlignError("Error - Align must be > 0.")
     logging.info(f"Using alignment: {args.align}")
-    gcm.rebuild_fst(p_input, align, skip_conf)
+    if trace_path is not None:
+        logging.info(f"Using files access trace: {trace_path}")
+    gcm.rebuild_fst(p_input, align, skip_conf, preserve_layout, trace_path, dedupe)
 
 
 def get_argparser():
@@ -1202,14 +2902,29 @@ def get_argparser():
     parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
     parser.add_argument('-v', '--verbose', action='store_true', help='verbose mode')
     parser.add_argument('-a', '--align', type=int, help='-a=10: alignment of files in the GCM ISO (default value is 4)', default=4)
+    parser.add_argument('-j', '--jobs', type=int, help='-j=4: threads count used to extract files with --unpack (default value is 1) or to hash files with --hash and --verify (default value is the CPU count)', default=None)
     parser.add_argument('-di', '--disable-ignore', action='store_true', help='-di: disable dol collisions verification when packing files sharing the same place in the GCM.')
+    parser.add_argument('-sp', '--sparse', action='store_true', help='-sp: keep empty spaces and all-zero blocks of files of the GCM/iso as sparse holes instead of allocating them when packing.')
+    parser.add_argument('-pl', '--preserve-layout', action='store_true', help='-pl: with --rebuild-fst keep files at theirs sys/fst.bin offsets when they still fit before the next file.')
+    parser.add_argument('-t', '--trace', metavar='TRACE', help='-t=trace.txt: with --rebuild-fst put files data in the reading order of this list of FST paths (one per line). FST ids are unchanged.', default=None)
+    parser.add_argument('-dd', '--dedupe', action='store_true', help='-dd: with --rebuild-fst files with the same content share the same data in the GCM/iso.')
+    parser.add_argument('-f', '--format', choices=["txt", "json"], default="txt", help="-f json: --stats output format - txt tables (default) or json lines records.")
     parser.add_argument('input_path', metavar='INPUT', help='')
     parser.add_argument('output_path', metavar='OUTPUT', help='', nargs='?', default="")
+    parser.add_argument('third_path', metavar='DEST', help='', nargs='?', default=None)
 
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('-p', '--pack', action='store_true', help="-p source_folder (dest_file.iso): Pack source_folder in new file source_folder.iso or dest_file.iso if specified.")
     group.add_argument('-u', '--unpack', action='store_true', help="-u source_iso.iso (dest_folder): Unpack the GCM/ISO in new folder source_iso or dest_folder if specified.")
     group.add_argument('-s', '--stats', action='store_true', help="-s source_iso.iso or source_folder (-a 4): Get stats about GCM, FST, memory, lengths and offsets.")
+    group.add_argument('-x', '--extract', action='store_true', help="-x game.iso fst_path_or_glob (dest): Extract files of the GCM/iso without unpacking it. Glob matches are extracted in dest/root/... or dest/sys/....")
+    group.add_argument('-ha', '--hash', action='store_true', help="-ha game.iso or game_folder (manifest) (-j 4): Write crc32 and sha1 of system files and FST files in manifest or game.iso.hash / game_folder.hash.")
+    group.add_argument('-ve', '--verify', action='store_true', help="-ve manifest game.iso or game_folder (-j 4): List files added, removed or modified compared to a --hash manifest.")
+    group.add_argument('-df', '--diff', action='store_true', help="-df original.iso modded.iso patch.bin: Write a patch with files matched by FST paths: references for unchanged files and binary deltas for modified files.")
+    group.add_argument('-ap', '--apply-patch', action='store_true', help="-ap original.iso patch.bin modded.iso: Rebuild modded.iso from original.iso and a --diff patch.")
+    group.add_argument('-st', '--status', action='store_true', help="-st source_folder: List files added, removed or modified since unpack using sys/manifest.")
+    group.add_argument('-pa', '--patch', action='store_true', help="-pa game.iso unpacked_folder (-a 4): Write in place in game.iso the root files modified since unpack that fit in their slot.")
+    group.add_argument('-ov', '--overlay', action='store_true', help="-ov original.iso changes_folder dest.iso (-a 4): Build dest.iso from original.iso with files of changes_folder/root replaced or added and a rebuilt FST.")
     group.add_argument('-r', '--rebuild-fst', action='store_true', help="-r game_folder (-a 4): Rebuild the game_folder/sys/fst.bin using files in game_folder/root. For ADPCM (...) use 0x8000 align.")
     group.add_argument('-ur', '--unpack-rebuild-fst', action='store_true', help="-ur source_iso.iso (dest_folder) (-a 4): Unpack and rebuild the FST.")
     group.add_argument('-rp', '--rebuild-fst-pack', action='store_true', help="-rp source_folder (dest_file.iso) (-a 4): Rebuild the FST and pack.")
@@ -1222,22 +2937,57 @@ if __name__ == '__main__':
 
     p_input = Path(args.input_path)
     p_output = Path(args.output_path)
+    trace_path = Path(args.trace) if args.trace is not None else None
 
     gcm = Gcm()
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
 
     if args.pack:
-        pack(p_input, p_output, args.disable_ignore)
+        pack(p_input, p_output, args.disable_ignore, sparse=args.sparse)
     elif args.unpack:
-        unpack(p_input, p_output)
+        unpack(p_input, p_output, args.jobs if args.jobs is not None else 1)
     elif args.stats:
-        gcm.stats(p_input)
+        gcm.stats(p_input, args.align, args.format)
+    elif args.status:
+        gcm.status(p_input)
+    elif args.diff or args.apply_patch:
+        if args.third_path is None:
+            raise InvalidPackIsoError(f"Error - Missing dest: {'--diff original.iso modded.iso patch.bin' if args.diff else '--apply-patch original.iso patch.bin modded.iso'}")
+        if args.diff:
+            logging.info("### Diff GCM isos in new patch")
+            gcm.diff(p_input, p_output, Path(args.third_path))
+        else:
+            logging.info("### Apply patch on GCM iso in new GCM iso")
+            gcm.apply_patch(p_input, p_output, Path(args.third_path))
+    elif args.hash:
+        logging.info("### Hash GCM iso files")
+        if p_output == Path("."):
+            p_output = p_input.parent / f"{p_input.name}.hash"
+        gcm.hash(p_input, p_output, hash_jobs(args.jobs))
+    elif args.verify:
+        logging.info("### Verify GCM iso files")
+        gcm.verify(p_input, p_output, hash_jobs(args.jobs))
+    elif args.extract:
+        logging.info("### Extract files from GCM iso")
+        gcm.extract(p_input, args.output_path, Path(args.third_path) if args.third_path is not None else None)
+    elif args.overlay:
+        logging.info("### Overlay changes on GCM iso in new GCM iso")
+        if args.align < 1:
+            raise BadAlignError("Error - Align must be > 0.")
+        if args.third_path is None:
+            raise InvalidPackIsoError("Error - Missing dest.iso: --overlay original.iso changes_folder dest.iso")
+        gcm.overlay(p_input, p_output, Path(args.third_path), args.align, args.sparse)
+    elif args.patch:
+        logging.info("### Patch GCM iso in place")
+        if args.align < 1:
+            raise BadAlignError("Error - Align must be > 0.")
+        gcm.patch(p_input, p_output, args.align)
     elif args.rebuild_fst:
-        rebuild_fst(p_input, args.align)
+        rebuild_fst(p_input, args.align, preserve_layout = args.preserve_layout, trace_path = trace_path, dedupe = args.dedupe)
     elif args.rebuild_fst_pack:
-        rebuild_fst(p_input, args.align) # rebuild fst parse and patch with conf
-        pack(p_input, p_output, args.disable_ignore, skip_conf = True)
+        rebuild_fst(p_input, args.align, preserve_layout = args.preserve_layout, trace_path = trace_path, dedupe = args.dedupe) # rebuild fst parse and patch with conf
+        pack(p_input, p_output, args.disable_ignore, skip_conf = True, sparse = args.sparse)
     elif args.unpack_rebuild_fst:
-        unpack(p_input, p_output) # conf isn't enabled yet
-        rebuild_fst(p_output, args.align, skip_conf = True)
+        unpack(p_input, p_output, args.jobs if args.jobs is not None else 1) # conf isn't enabled yet
+        rebuild_fst(p_output, args.align, skip_conf = True, preserve_layout = args.preserve_layout, trace_path = trace_path, dedupe = args.dedupe)